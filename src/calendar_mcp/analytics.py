@@ -0,0 +1,172 @@
+"""Mailbox statistics streamed over every message matching a query
+
+Message IDs are listed a page at a time and their headers fetched in
+concurrent batches, feeding counters whose size does not grow with the
+mailbox. A token bucket keeps the scan under Gmail's per-user quota, so
+even a 100k-message mailbox is read at a steady rate rather than
+hitting rate limits.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parseaddr
+from typing import Callable
+from .auth import get_gmail_service
+from .deadlines import execute_request
+from .mail import GMAIL_BATCH_MAX, batch_get_messages, get_headers
+
+ANALYZE_MAX_MESSAGES = 10000
+ANALYZE_CONCURRENCY = 4
+# Gmail allows 250 quota units per user per second; leave room for other tools
+ANALYZE_QUOTA_UNITS_PER_SECOND = float(os.environ.get('CALENDAR_MCP_ANALYZE_QUOTA', '150'))
+LIST_COST = 5
+GET_COST = 5
+TRACKED_KEYS = 1000
+
+class QuotaBudget:
+    """Thread-safe token bucket of API quota units"""
+
+    def __init__(self, units_per_second: float = ANALYZE_QUOTA_UNITS_PER_SECOND):
+        self.rate = units_per_second
+        self._available = units_per_second
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def spend(self, units: float):
+        """Block until the units can be spent"""
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.rate, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= units
+            wait = -self._available / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+class TopCounter:
+    """Counts of the most frequent keys in bounded memory
+
+    Space-Saving with batched eviction: holds at most twice the capacity,
+    and when full keeps only the top half. A key that arrives after keys
+    were dropped starts from the largest dropped count and remembers it as
+    its error, so every count is at most that error above the truth and
+    never below it.
+    """
+
+    def __init__(self, capacity: int = TRACKED_KEYS):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+
+    def add(self, key: str):
+        if key in self.counts:
+            self.counts[key] += 1
+            return
+        self.counts[key] = self.floor + 1
+        self.errors[key] = self.floor
+        if len(self.counts) > 2 * self.capacity:
+            ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+            self.floor = max(self.floor, ranked[self.capacity][1])
+            self.counts = dict(ranked[:self.capacity])
+            self.errors = {key: self.errors[key] for key in self.counts}
+
+    def most_common(self, n: int) -> list[tuple[str, int]]:
+        return Counter(self.counts).most_common(n)
+
+    def max_error(self, n: int) -> int:
+        """Most any of the top n counts can exceed the true count"""
+        return max((self.errors[key] for key, _ in self.most_common(n)), default=0)
+
+class MailboxStats:
+    """Streaming aggregates over message metadata"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bulk = 0
+        self.senders = TopCounter()
+        self.domains = TopCounter()
+        # Label and month counts are bounded by the account, not the mailbox
+        self.labels = Counter()
+        self.months = Counter()
+        self.first = None
+        self.last = None
+
+    def add(self, message: dict):
+        self.messages += 1
+        headers = get_headers(message)
+        address = parseaddr(headers.get('From', ''))[1].lower()
+        if address:
+            self.senders.add(address)
+            self.domains.add(address.rpartition('@')[2])
+        # Mailing lists and newsletters are required to carry List-Unsubscribe
+        if 'List-Unsubscribe' in headers:
+            self.bulk += 1
+        self.labels.update(message.get('labelIds', []))
+        if message.get('internalDate'):
+            received = datetime.fromtimestamp(int(message['internalDate']) / 1000, timezone.utc)
+            self.months[received.strftime('%Y-%m')] += 1
+            self.first = min(self.first, received) if self.first else received
+            self.last = max(self.last, received) if self.last else received
+
+def analyze_mailbox(query: str = None, max_messages: int = ANALYZE_MAX_MESSAGES,
+                    concurrency: int = ANALYZE_CONCURRENCY, service_factory=get_gmail_service,
+                    progress: Callable[[int], None] = None) -> tuple[MailboxStats, dict]:
+    """Aggregate senders, domains, labels and volume for messages matching a query
+
+    Returns (stats, info) where info holds the result size estimate, label
+    names and the number of messages that could not be fetched.
+    """
+    budget = QuotaBudget()
+    service = service_factory()
+    stats = MailboxStats()
+    info = {'estimate': None, 'failed': 0, 'truncated': False}
+
+    budget.spend(LIST_COST)
+    labels = execute_request(service.users().labels().list(userId='me', fields='labels(id,name)'))
+    info['label_names'] = {label['id']: label['name'] for label in labels.get('labels', [])}
+
+    def fetch(ids):
+        budget.spend(GET_COST * len(ids))
+        return batch_get_messages(
+            service_factory(), ids,
+            format='metadata',
+            metadataHeaders=['From', 'List-Unsubscribe'],
+            fields='id,labelIds,internalDate,payload/headers'
+        )
+
+    page_token = None
+    with ThreadPoolExecutor(concurrency) as pool:
+        while stats.messages + info['failed'] < max_messages:
+            budget.spend(LIST_COST)
+            result = execute_request(service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=min(500, max_messages - stats.messages - info['failed']),
+                pageToken=page_token,
+                fields='messages/id,nextPageToken,resultSizeEstimate'
+            ))
+            if info['estimate'] is None:
+                info['estimate'] = result.get('resultSizeEstimate')
+            ids = [m['id'] for m in result.get('messages', [])]
+            batches = [ids[i:i + GMAIL_BATCH_MAX] for i in range(0, len(ids), GMAIL_BATCH_MAX)]
+            # Each batch carries the call's context so the deadline still applies
+            futures = [pool.submit(contextvars.copy_context().run, fetch, batch) for batch in batches]
+            for found, failed in (future.result() for future in futures):
+                for message in found.values():
+                    stats.add(message)
+                info['failed'] += len(failed)
+            if progress:
+                progress(stats.messages)
+
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        else:
+            info['truncated'] = page_token is not None
+
+    return stats, info
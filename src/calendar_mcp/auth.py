@@ -5,13 +5,22 @@ from pathlib import Path
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+import httplib2
 
 SCOPES = [
     'https://www.googleapis.com/auth/calendar',
     'https://www.googleapis.com/auth/gmail.modify'
 ]
 
+# Socket timeout for every Google API connection, so a stalled request fails
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('CALENDAR_MCP_HTTP_TIMEOUT', '30'))
+
+def _authorized_http(creds):
+    """HTTP transport with a socket timeout"""
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS))
+
 def get_calendar_service():
     """Authenticate and return Google Calendar service"""
     creds = None
@@ -44,7 +53,7 @@ def get_calendar_service():
         with open(token_path, 'w') as token:
             token.write(creds.to_json())
     
-    return build('calendar', 'v3', credentials=creds)
+    return build('calendar', 'v3', http=_authorized_http(creds))
 
 def get_gmail_service():
     """Authenticate and return Gmail service"""
@@ -78,4 +87,4 @@ def get_gmail_service():
         with open(token_path, 'w') as token:
             token.write(creds.to_json())
     
-    return build('gmail', 'v1', credentials=creds)
+    return build('gmail', 'v1', http=_authorized_http(creds))
@@ -0,0 +1,153 @@
+"""Group availability search over freebusy queries"""
+import asyncio
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from .auth import get_calendar_service
+from .deadlines import execute_request
+from .times import get_zone, parse_iso
+
+# freebusy.query accepts at most 50 calendars or groups per request
+FREEBUSY_MAX_ITEMS = 50
+# Largest group expansion the API allows
+GROUP_EXPANSION_MAX = 100
+
+def merge_intervals(intervals) -> list[tuple[datetime, datetime]]:
+    """Sort and coalesce overlapping or touching intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def intersect_intervals(a, b) -> list[tuple[datetime, datetime]]:
+    """Intersect two sorted, non-overlapping interval lists"""
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def work_windows(zone: str, time_min: datetime, time_max: datetime,
+                 work_start: int, work_end: int) -> list[tuple[datetime, datetime]]:
+    """Weekday work hours in a timezone, as UTC intervals clipped to the range"""
+    tz = get_zone(zone)
+    day = time_min.astimezone(tz).date()
+    last = time_max.astimezone(tz).date()
+    windows = []
+    while day <= last:
+        if day.weekday() < 5:
+            start = datetime(day.year, day.month, day.day, work_start, tzinfo=tz)
+            end = datetime(day.year, day.month, day.day, work_end, tzinfo=tz)
+            start = max(start.astimezone(timezone.utc), time_min)
+            end = min(end.astimezone(timezone.utc), time_max)
+            if start < end:
+                windows.append((start, end))
+        day += timedelta(days=1)
+    return windows
+
+def _query_chunk(service, items: list[str], time_min: datetime, time_max: datetime):
+    result = execute_request(service.freebusy().query(body={
+        'timeMin': time_min.isoformat(),
+        'timeMax': time_max.isoformat(),
+        'groupExpansionMax': GROUP_EXPANSION_MAX,
+        'items': [{'id': item} for item in items]
+    }))
+
+    groups = set(result.get('groups', {}))
+    busy = {}
+    errors = {}
+    for calendar_id, info in result.get('calendars', {}).items():
+        if calendar_id in groups:
+            continue
+        if info.get('errors'):
+            errors[calendar_id] = info['errors'][0].get('reason', 'unknown')
+            continue
+        busy[calendar_id] = [(parse_iso(b['start']), parse_iso(b['end'])) for b in info.get('busy', [])]
+    for group, info in result.get('groups', {}).items():
+        if info.get('errors'):
+            errors[group] = info['errors'][0].get('reason', 'unknown')
+    return busy, errors
+
+async def query_busy(items: list[str], time_min: datetime, time_max: datetime,
+                     service_factory=get_calendar_service):
+    """Busy intervals per calendar, fetched in concurrent freebusy chunks
+
+    Groups are expanded into their members. Returns (busy, errors) where busy
+    maps each calendar to its merged busy intervals.
+    """
+    chunks = [items[i:i + FREEBUSY_MAX_ITEMS] for i in range(0, len(items), FREEBUSY_MAX_ITEMS)]
+    results = await asyncio.gather(*(
+        asyncio.to_thread(lambda chunk=chunk: _query_chunk(service_factory(), chunk, time_min, time_max))
+        for chunk in chunks
+    ))
+
+    busy = {}
+    errors = {}
+    for chunk_busy, chunk_errors in results:
+        for calendar_id, intervals in chunk_busy.items():
+            busy.setdefault(calendar_id, []).extend(intervals)
+        errors.update(chunk_errors)
+    return {calendar_id: merge_intervals(intervals) for calendar_id, intervals in busy.items()}, errors
+
+def rank_slots(busy: dict, windows, duration: timedelta, step: timedelta,
+               max_results: int = 10) -> list[tuple[datetime, list[str]]]:
+    """Candidate slots inside the windows, fewest busy attendees first
+
+    Each attendee's merged intervals are checked with a binary search, so a
+    candidate costs O(attendees * log(intervals)).
+    """
+    indexed = [
+        (calendar_id, [end for _, end in intervals], [start for start, _ in intervals])
+        for calendar_id, intervals in busy.items()
+    ]
+    step_seconds = int(step.total_seconds())
+
+    candidates = []
+    for window_start, window_end in windows:
+        # Align candidates to the step so slots start on round times
+        offset = -int(window_start.timestamp()) % step_seconds
+        slot = window_start + timedelta(seconds=offset)
+        while slot + duration <= window_end:
+            slot_end = slot + duration
+            conflicts = []
+            for calendar_id, ends, starts in indexed:
+                i = bisect_right(ends, slot)
+                if i < len(starts) and starts[i] < slot_end:
+                    conflicts.append(calendar_id)
+            candidates.append((len(conflicts), slot, conflicts))
+            slot += step
+
+    candidates.sort(key=lambda c: (c[0], c[1]))
+    return [(slot, conflicts) for _, slot, conflicts in candidates[:max_results]]
+
+async def find_common_slots(attendees: list[str], time_min: datetime, time_max: datetime,
+                            duration: timedelta, step: timedelta, work_start: int,
+                            work_end: int, default_timezone: str = 'UTC',
+                            attendee_timezones: dict = None, max_results: int = 10,
+                            service_factory=get_calendar_service):
+    """Rank meeting slots for a group of attendees
+
+    Returns (slots, attendee_count, errors).
+    """
+    attendee_timezones = attendee_timezones or {}
+    busy, errors = await query_busy(attendees, time_min, time_max, service_factory)
+
+    # Work hours only depend on the timezone, so intersect each zone once
+    zones = {attendee_timezones.get(calendar_id, default_timezone) for calendar_id in busy}
+    zones.add(default_timezone)
+    windows = [(time_min, time_max)]
+    for zone in sorted(zones):
+        windows = intersect_intervals(windows, work_windows(zone, time_min, time_max, work_start, work_end))
+
+    slots = rank_slots(busy, windows, duration, step, max_results)
+    return slots, len(busy), errors
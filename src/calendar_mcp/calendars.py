@@ -0,0 +1,87 @@
+"""Querying several calendars at once"""
+import asyncio
+import heapq
+import itertools
+from typing import Callable
+from .auth import get_calendar_service
+from .deadlines import execute_request
+from .recurrence import event_sort_key
+from .times import parse_iso, to_utc
+
+async def resolve_calendar_ids(service, calendar_ids=None) -> list[str]:
+    """Expand a calendar_ids argument into concrete IDs
+
+    None means the primary calendar and "all" means every calendar in the
+    user's calendar list, which is paged through in a worker thread.
+    """
+    if not calendar_ids:
+        return ['primary']
+    if isinstance(calendar_ids, str):
+        calendar_ids = [calendar_ids]
+    if 'all' not in calendar_ids:
+        return list(dict.fromkeys(calendar_ids))
+    return await asyncio.to_thread(_list_calendar_ids, service)
+
+def _list_calendar_ids(service) -> list[str]:
+    ids = []
+    page_token = None
+    while True:
+        result = execute_request(service.calendarList().list(
+            pageToken=page_token,
+            fields='items(id),nextPageToken'
+        ))
+        ids.extend(item['id'] for item in result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return ids
+
+def _dedupe_key(event: dict):
+    """Same iCalUID and start means the same event seen on another calendar
+
+    Each calendar reports times in its own timezone, so timed starts are
+    compared in UTC.
+    """
+    when = event.get('originalStartTime') or event['start']
+    start = to_utc(parse_iso(when['dateTime'])) if 'dateTime' in when else when.get('date')
+    return event.get('iCalUID') or event['id'], start
+
+def merge_events(event_lists, max_results: int = None) -> list[dict]:
+    """k-way merge start-ordered event lists, dropping cross-calendar duplicates"""
+    seen = set()
+    merged = []
+    for event in heapq.merge(*event_lists, key=event_sort_key):
+        key = _dedupe_key(event)
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(event)
+        if max_results and len(merged) >= max_results:
+            break
+    return merged
+
+async def fetch_from_calendars(service, calendar_ids: list[str],
+                               fetch: Callable[[object, str], list[dict]],
+                               max_results: int = None,
+                               service_factory=get_calendar_service) -> list[dict]:
+    """Run fetch(service, calendar_id) for every calendar and merge the results
+
+    fetch must return events ordered by start time. A single calendar is
+    fetched in a worker thread with the given service; several are fetched concurrently,
+    each on its own service since the HTTP transport is not thread-safe.
+    """
+    if len(calendar_ids) == 1:
+        events = await asyncio.to_thread(fetch, service, calendar_ids[0])
+        for event in events:
+            event.setdefault('calendarId', calendar_ids[0])
+        return list(itertools.islice(events, max_results)) if max_results else events
+
+    def fetch_one(calendar_id):
+        events = fetch(service_factory(), calendar_id)
+        for event in events:
+            event.setdefault('calendarId', calendar_id)
+        return events
+
+    event_lists = await asyncio.gather(
+        *(asyncio.to_thread(fetch_one, calendar_id) for calendar_id in calendar_ids)
+    )
+    return merge_events(event_lists, max_results)
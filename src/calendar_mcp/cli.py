@@ -0,0 +1,85 @@
+"""Command-line entry point for the MCP server, export and load-test tools"""
+import argparse
+import asyncio
+from .times import parse_datetime
+
+def main(argv=None):
+    """Run the MCP server, or an export or load-test subcommand"""
+    parser = argparse.ArgumentParser(prog='google-calendar-mcp')
+    subcommands = parser.add_subparsers(dest='command')
+
+    subcommands.add_parser('serve', help='Run the MCP server over stdio (default)')
+
+    ics = subcommands.add_parser('export-ics', help='Export calendar events to an .ics file')
+    ics.add_argument('output', help='Path of the .ics file to write')
+    ics.add_argument('--start', help='Only events ending after this date')
+    ics.add_argument('--end', help='Only events starting before this date')
+    ics.add_argument('--calendar-id', default='primary', help='Calendar to export (default: primary)')
+
+    mbox = subcommands.add_parser('export-mbox', help='Export Gmail messages to an .mbox file')
+    mbox.add_argument('output', help='Path of the .mbox file to write')
+    mbox.add_argument('--query', help="Gmail search query, e.g. 'label:work after:2024/01/01'")
+    mbox.add_argument('--batch-size', type=int, default=50, help='Messages per batch request (default: 50)')
+    mbox.add_argument('--concurrency', type=int, default=4, help='Batches fetched in parallel (default: 4)')
+
+    load = subcommands.add_parser('loadtest', help='Measure how the server scales with concurrent tool calls')
+    load.add_argument('--trace', help='JSON lines of recorded tool calls to replay (default: synthetic mix)')
+    load.add_argument('--concurrency', default='1,2,4,8,16,32', help='Comma-separated concurrency steps (default: 1,2,4,8,16,32)')
+    load.add_argument('--duration', type=float, default=10, help='Seconds per step (default: 10)')
+    load.add_argument('--latency-ms', type=float, default=20, help='Fake API round trip in ms (default: 20)')
+    load.add_argument('--events', type=int, default=200, help='Events in the fake calendar (default: 200)')
+    load.add_argument('--messages', type=int, default=1000, help='Messages in the fake mailbox (default: 1000)')
+    load.add_argument('--format', choices=['text', 'json'], help='Output format requested from every tool')
+    load.add_argument('--json', dest='json_output', help='Also write the results to this JSON file')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'export-ics':
+        from .export import export_ics
+        try:
+            count = export_ics(
+                args.output,
+                time_min=parse_datetime(args.start, 'UTC') if args.start else None,
+                time_max=parse_datetime(args.end, 'UTC') if args.end else None,
+                calendar_id=args.calendar_id
+            )
+        except ValueError as e:
+            parser.exit(1, f"❌ {e}\n")
+        print(f"✅ Exported {count} events to {args.output}")
+    elif args.command == 'export-mbox':
+        from .export import export_mbox
+        try:
+            count = export_mbox(
+                args.output,
+                query=args.query,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency
+            )
+        except ValueError as e:
+            parser.exit(1, f"❌ {e}\n")
+        print(f"✅ Exported {count} messages to {args.output}")
+    elif args.command == 'loadtest':
+        import json
+        from .loadtest import STEP_HEADER, format_step, run_load, synthetic_trace
+        from .trace import load_trace
+        calls = load_trace(args.trace) if args.trace else synthetic_trace(events=args.events, messages=args.messages)
+        print(STEP_HEADER)
+        steps = asyncio.run(run_load(
+            calls,
+            concurrency=[int(level) for level in args.concurrency.split(',')],
+            step_seconds=args.duration,
+            events=args.events,
+            messages=args.messages,
+            latency_ms=args.latency_ms,
+            output_format=args.format,
+            progress=lambda step: print(format_step(step), flush=True)
+        ))
+        if args.json_output:
+            with open(args.json_output, 'w') as f:
+                json.dump(steps, f, indent=2)
+    else:
+        from .server import main as serve
+        asyncio.run(serve())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""In-memory interval index for event conflict checks"""
+import time
+from datetime import datetime, timedelta, timezone
+from .calendars import fetch_from_calendars
+from .deadlines import execute_request
+from .recurrence import event_bounds
+from .times import to_utc
+
+# How long a loaded index is trusted before it is fetched again
+CONFLICT_INDEX_TTL_SECONDS = 120
+# Extra days loaded past the requested range so nearby checks reuse the index
+CONFLICT_WINDOW_PADDING_DAYS = 7
+
+class EventSpan:
+    """Compact [start, end) record for one busy event"""
+    __slots__ = ('start', 'end', 'event_id', 'summary', 'calendar_id')
+
+    def __init__(self, start: float, end: float, event_id: str, summary: str,
+                 calendar_id: str = 'primary'):
+        self.start = start
+        self.end = end
+        self.event_id = event_id
+        self.summary = summary
+        self.calendar_id = calendar_id
+
+    @classmethod
+    def from_event(cls, event: dict, calendar_id: str = 'primary'):
+        start, end = event_bounds(event)
+        return cls(
+            start.timestamp(),
+            end.timestamp(),
+            event['id'],
+            event.get('summary', 'No title'),
+            event.get('calendarId', calendar_id)
+        )
+
+class _Node:
+    """Centered interval tree node"""
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, spans: list):
+        points = sorted(p for span in spans for p in (span.start, span.end))
+        # The lower median never sends every span to one side
+        self.center = points[(len(points) - 1) // 2]
+        here, left, right = [], [], []
+        for span in spans:
+            if span.end <= self.center:
+                left.append(span)
+            elif span.start > self.center:
+                right.append(span)
+            else:
+                here.append(span)
+        self.by_start = sorted(here, key=lambda s: s.start)
+        self.by_end = sorted(here, key=lambda s: s.end, reverse=True)
+        self.left = _Node(left) if left else None
+        self.right = _Node(right) if right else None
+
+class IntervalIndex:
+    """Centered interval tree answering overlap queries in O(log n + k)"""
+
+    def __init__(self, spans=()):
+        self._spans = {}
+        self._root = None
+        self._dirty = True
+        for span in spans:
+            self.add(span)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def add(self, span: EventSpan):
+        """Insert or replace a span; the tree is rebuilt on the next query"""
+        if span.end <= span.start:
+            # Zero-length events can never overlap a half-open range
+            return
+        self._spans[span.event_id] = span
+        self._dirty = True
+
+    def discard(self, event_id: str):
+        """Remove a span if present"""
+        if self._spans.pop(event_id, None) is not None:
+            self._dirty = True
+
+    def overlapping(self, start: float, end: float) -> list[EventSpan]:
+        """Spans that overlap [start, end), ordered by start"""
+        if self._dirty:
+            spans = list(self._spans.values())
+            self._root = _Node(spans) if spans else None
+            self._dirty = False
+
+        found = []
+        node = self._root
+        stack = [node] if node else []
+        while stack:
+            node = stack.pop()
+            if end <= node.center:
+                # Everything here ends after center >= end > start
+                for span in node.by_start:
+                    if span.start >= end:
+                        break
+                    found.append(span)
+                if node.left:
+                    stack.append(node.left)
+            elif start >= node.center:
+                for span in node.by_end:
+                    if span.end <= start:
+                        break
+                    found.append(span)
+                if node.right:
+                    stack.append(node.right)
+            else:
+                found.extend(node.by_start)
+                if node.left:
+                    stack.append(node.left)
+                if node.right:
+                    stack.append(node.right)
+        found.sort(key=lambda s: s.start)
+        return found
+
+def fetch_busy_events(service, calendar_id: str, time_min: datetime, time_max: datetime) -> list[dict]:
+    """Fetch the busy events of one calendar in a range, ordered by start"""
+    events = []
+    page_token = None
+    while True:
+        result = execute_request(service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            singleEvents=True,
+            orderBy='startTime',
+            maxResults=2500,
+            pageToken=page_token,
+            fields='items(id,iCalUID,summary,start,end,transparency,status),nextPageToken'
+        ))
+        events.extend(
+            event for event in result.get('items', [])
+            if event.get('transparency') != 'transparent' and event.get('status') != 'cancelled'
+        )
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return events
+
+class ConflictIndexCache:
+    """Loaded interval indexes keyed by calendar set, each covering a window"""
+
+    def __init__(self, ttl: float = CONFLICT_INDEX_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key, time_min: datetime, time_max: datetime):
+        """Return an index covering [time_min, time_max), or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        loaded_at, window_min, window_max, index = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            del self._entries[key]
+            return None
+        if time_min < window_min or time_max > window_max:
+            return None
+        return index
+
+    def put(self, key, time_min: datetime, time_max: datetime, index: IntervalIndex):
+        self._entries[key] = (time.monotonic(), time_min, time_max, index)
+
+    def add(self, span: EventSpan):
+        """Record a newly created event in every index of its calendar"""
+        for key, (_, _, _, index) in self._entries.items():
+            if span.calendar_id in key:
+                index.add(span)
+
+    def discard(self, event_id: str):
+        """Forget a deleted event everywhere"""
+        for _, _, _, index in self._entries.values():
+            index.discard(event_id)
+
+    def clear(self):
+        self._entries.clear()
+
+conflict_indexes = ConflictIndexCache()
+
+def padded_window(time_min: datetime, time_max: datetime) -> tuple[datetime, datetime]:
+    """Day-aligned window around a range, padded for reuse by nearby checks"""
+    start = time_min.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = time_max.astimezone(timezone.utc) + timedelta(days=CONFLICT_WINDOW_PADDING_DAYS)
+    return start, end
+
+async def get_conflict_index(service, calendar_ids: list[str], time_min: datetime,
+                             time_max: datetime) -> IntervalIndex:
+    """Return a cached index covering the range, loading it with one fetch if needed"""
+    time_min, time_max = to_utc(time_min), to_utc(time_max)
+    key = tuple(calendar_ids)
+    index = conflict_indexes.get(key, time_min, time_max)
+    if index is not None:
+        return index
+
+    window_min, window_max = padded_window(time_min, time_max)
+    events = await fetch_from_calendars(
+        service,
+        calendar_ids,
+        lambda calendar_service, calendar_id: fetch_busy_events(
+            calendar_service, calendar_id, window_min, window_max
+        )
+    )
+    index = IntervalIndex(EventSpan.from_event(event) for event in events)
+    conflict_indexes.put(key, window_min, window_max, index)
+    return index
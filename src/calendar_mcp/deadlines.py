@@ -0,0 +1,164 @@
+"""Per-call deadlines, cancellation and hedged reads for Google API requests
+
+call_tool opens a CallState for every tool call. Every API request made on
+behalf of that call, including those in worker threads, goes through
+execute_request, which refuses to start once the deadline has passed or the
+call was cancelled. A request already sent is only bounded by the socket
+timeout, but requests run off the event loop, so a stalled request never
+blocks the server and the handler can be abandoned immediately.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.http import HttpRequest
+from .auth import HTTP_TIMEOUT_SECONDS
+
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get('CALENDAR_MCP_DEADLINE', '30'))
+# Tools that legitimately take longer than a single read
+TOOL_DEADLINES = {
+    "find_common_slots": 60,
+    "import_ics": 600,
+    "analyze_mailbox": 3600,
+}
+
+# Send a duplicate of slow idempotent reads once they exceed their recent p95
+HEDGE_ENABLED = os.environ.get('CALENDAR_MCP_HEDGE', '').lower() in ('1', 'true', 'yes')
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='hedge')
+
+class DeadlineExceeded(TimeoutError):
+    """The tool call ran out of time before the request could start"""
+
+class CallCancelled(Exception):
+    """The client cancelled the tool call"""
+
+class CallState:
+    """Deadline and cancellation flag shared by everything one tool call runs"""
+
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds
+        self.cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise CallCancelled("Tool call was cancelled")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("Tool call deadline exceeded")
+
+_current_call = contextvars.ContextVar('current_call', default=None)
+
+def tool_deadline(name: str) -> float:
+    """Deadline in seconds for a tool"""
+    return TOOL_DEADLINES.get(name, DEFAULT_DEADLINE_SECONDS)
+
+def start_call(name: str) -> tuple[CallState, contextvars.Token]:
+    """Begin tracking a tool call in the current context"""
+    state = CallState(tool_deadline(name))
+    return state, _current_call.set(state)
+
+def end_call(token: contextvars.Token):
+    _current_call.reset(token)
+
+class LatencyTracker:
+    """Recent latencies per API method, for picking hedge delays"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def p95(self, key: str):
+        """95th percentile latency, or None until enough samples exist"""
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+latencies = LatencyTracker()
+
+def _duplicate(request: HttpRequest):
+    """Copy a request onto its own connection, or None if that is not possible"""
+    http = request.http
+    if not isinstance(http, AuthorizedHttp):
+        return None
+    fresh = AuthorizedHttp(http.credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS))
+    return HttpRequest(
+        fresh,
+        request.postproc,
+        request.uri,
+        method=request.method,
+        body=request.body,
+        headers=dict(request.headers),
+        methodId=request.methodId,
+        resumable=request.resumable
+    )
+
+def _execute_hedged(request: HttpRequest, delay: float, state: CallState):
+    primary = _hedge_pool.submit(request.execute)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    backup_request = _duplicate(request)
+    if backup_request is None:
+        return primary.result(timeout=state.remaining() if state else None)
+
+    pending = {primary, _hedge_pool.submit(backup_request.execute)}
+    error = None
+    while pending:
+        done, pending = wait(
+            pending,
+            timeout=max(state.remaining(), 0) if state else None,
+            return_when=FIRST_COMPLETED
+        )
+        if not done:
+            raise DeadlineExceeded("Tool call deadline exceeded")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+def execute_request(request, hedge: bool = False):
+    """Execute an API request (or batch) under the current call's deadline
+
+    The deadline is checked before the request starts; once sent, it runs
+    until it completes or hits the socket timeout.
+
+    With hedge=True and hedging enabled, idempotent reads slower than their
+    recent p95 get a duplicate request and the first response wins.
+    """
+    state = _current_call.get()
+    if state is not None:
+        state.check()
+
+    key = getattr(request, 'methodId', None) or type(request).__name__
+    started = time.monotonic()
+    delay = latencies.p95(key) if hedge and HEDGE_ENABLED and isinstance(request, HttpRequest) else None
+    if delay is not None:
+        result = _execute_hedged(request, delay, state)
+    else:
+        result = request.execute()
+    latencies.record(key, time.monotonic() - started)
+    return result
+
+async def execute(request, hedge: bool = False):
+    """Run execute_request off the event loop so deadlines and cancellation apply"""
+    return await asyncio.to_thread(execute_request, request, hedge)
@@ -0,0 +1,374 @@
+"""Streaming export of calendar events to ICS and mail to mbox
+
+Both exports write page by page with constant memory and keep a JSON
+checkpoint next to the output file, so an interrupted export resumes from
+the last completed page instead of starting over.
+"""
+import base64
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from googleapiclient.errors import HttpError
+from .auth import get_calendar_service, get_gmail_service
+from .mail import GMAIL_BATCH_MAX, batch_get_messages
+from .times import get_zone, parse_iso
+
+MBOX_BATCH_SIZE = 50
+MBOX_CONCURRENCY = 4
+MBOX_RETRIES = 3
+VTIMEZONE_YEARS_AHEAD = 5
+
+class Checkpoint:
+    """Resume state stored as JSON beside the output file
+
+    The export's parameters are saved with it. A rerun with different
+    parameters is refused rather than appending mismatched data, and a
+    checkpoint whose output file is gone is discarded.
+    """
+
+    def __init__(self, output: Path, params: dict):
+        self.path = output.with_name(output.name + '.checkpoint')
+        self.params = params
+        self.state = None
+        if not self.path.exists():
+            return
+        state = json.loads(self.path.read_text())
+        if not output.exists():
+            self.clear()
+        elif state.get('params') != params:
+            raise ValueError(
+                f"{output} is an unfinished export with different options; "
+                f"rerun with the same options or delete {self.path} to start over"
+            )
+        else:
+            self.state = state
+
+    def save(self, **state):
+        state['params'] = self.params
+        self.state = state
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(json.dumps(state))
+        tmp.replace(self.path)
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+def _open_output(output: Path, checkpoint: Checkpoint):
+    """Open the output for appending, dropping anything after the last checkpoint"""
+    if checkpoint.state is None:
+        return open(output, 'wb')
+    out = open(output, 'r+b')
+    out.truncate(checkpoint.state['offset'])
+    out.seek(checkpoint.state['offset'])
+    return out
+
+def _progress(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+# ICS
+
+def _ics_escape(text: str) -> str:
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _ics_fold(line: str) -> str:
+    """Fold a content line at 75 octets as RFC 5545 requires"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    current = ''
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(current)
+            current = ''
+            size = 0
+            # Continuation lines start with a space that counts toward the limit
+            limit = 74
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+def _note_zone(zones: dict, name: str, year: int):
+    """Widen the range of years a TZID is used in"""
+    if zones is None:
+        return
+    low, high = zones.get(name, (year, year))
+    zones[name] = [min(low, year), max(high, year)]
+
+def _ics_time(name: str, when: dict, zones: dict = None) -> str:
+    if 'date' in when:
+        return f"{name};VALUE=DATE:{when['date'].replace('-', '')}"
+    dt = parse_iso(when['dateTime'])
+    if when.get('timeZone'):
+        local = dt.astimezone(get_zone(when['timeZone'])) if dt.tzinfo else dt
+        _note_zone(zones, when['timeZone'], local.year)
+        return f"{name};TZID={when['timeZone']}:{local.strftime('%Y%m%dT%H%M%S')}"
+    return f"{name}:{dt.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+_RECURRENCE_TZID = re.compile(r';TZID=([^:;]+).*?:(\d{4})')
+
+def event_to_ics(event: dict, uid: str = None, zones: dict = None) -> str:
+    """Render one Calendar API event as a VEVENT block
+
+    uid overrides the event's own iCalUID, for cancelled instances that
+    only name their series by recurringEventId. Every TZID written is
+    recorded in zones with the years it covers, for the VTIMEZONE blocks.
+    """
+    uid = uid or event.get('iCalUID', event['id'])
+    lines = ['BEGIN:VEVENT', f"UID:{uid}"]
+    start = event.get('start') or event.get('originalStartTime')
+    lines.append(_ics_time('DTSTART', start, zones))
+    if event.get('end'):
+        lines.append(_ics_time('DTEND', event['end'], zones))
+    if event.get('originalStartTime'):
+        lines.append(_ics_time('RECURRENCE-ID', event['originalStartTime'], zones))
+    for line in event.get('recurrence', []):
+        match = _RECURRENCE_TZID.search(line)
+        if match:
+            _note_zone(zones, match.group(1), int(match.group(2)))
+        lines.append(line)
+    stamp = parse_iso(event['updated']) if event.get('updated') else datetime.now(timezone.utc)
+    lines.append(f"DTSTAMP:{stamp.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}")
+    if event.get('summary'):
+        lines.append(f"SUMMARY:{_ics_escape(event['summary'])}")
+    if event.get('description'):
+        lines.append(f"DESCRIPTION:{_ics_escape(event['description'])}")
+    if event.get('location'):
+        lines.append(f"LOCATION:{_ics_escape(event['location'])}")
+    if event.get('status'):
+        lines.append(f"STATUS:{event['status'].upper()}")
+    if event.get('transparency') == 'transparent':
+        lines.append('TRANSP:TRANSPARENT')
+    for attendee in event.get('attendees', []):
+        lines.append(f"ATTENDEE;PARTSTAT={attendee.get('responseStatus', 'needsAction').upper()}:mailto:{attendee['email']}")
+    lines.append('END:VEVENT')
+    return ''.join(_ics_fold(line) for line in lines)
+
+def _utc_offset(offset: timedelta) -> str:
+    minutes = int(offset.total_seconds() // 60)
+    sign = '+' if minutes >= 0 else '-'
+    return f"{sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}"
+
+def _offset_changes(zone, start: datetime, end: datetime) -> list[datetime]:
+    """UTC instants in [start, end) at which the zone's UTC offset changes"""
+    changes = []
+    day = timedelta(days=1)
+    before = start.astimezone(zone).utcoffset()
+    t = start
+    while t < end:
+        after = (t + day).astimezone(zone).utcoffset()
+        if after != before:
+            # Offsets change on whole minutes; bisect down to the minute
+            low, high = int(t.timestamp()) // 60, int((t + day).timestamp()) // 60
+            while high - low > 1:
+                middle = (low + high) // 2
+                if datetime.fromtimestamp(middle * 60, timezone.utc).astimezone(zone).utcoffset() == before:
+                    low = middle
+                else:
+                    high = middle
+            changes.append(datetime.fromtimestamp(high * 60, timezone.utc))
+            before = after
+        t += day
+    return changes
+
+def vtimezone(name: str, first_year: int, last_year: int) -> str:
+    """VTIMEZONE block for an IANA zone, covering the given years
+
+    Each kind of offset change becomes one STANDARD or DAYLIGHT
+    observance listing its onsets as RDATEs.
+    """
+    zone = get_zone(name)
+    start = datetime(first_year, 1, 1, tzinfo=timezone.utc)
+    end = datetime(last_year + 1, 1, 1, tzinfo=timezone.utc)
+    initial = start.astimezone(zone).utcoffset()
+    # (kind, offset from, offset to, abbreviation) -> onsets in local time before the change
+    observances = {}
+    onsets = [(start, initial)]
+    previous = initial
+    for instant in _offset_changes(zone, start, end):
+        onsets.append((instant, previous))
+        previous = instant.astimezone(zone).utcoffset()
+    for instant, offset_from in onsets:
+        local = instant.astimezone(zone)
+        kind = 'DAYLIGHT' if local.dst() else 'STANDARD'
+        key = (kind, offset_from, local.utcoffset(), local.tzname())
+        observances.setdefault(key, []).append((instant + offset_from).strftime('%Y%m%dT%H%M%S'))
+
+    lines = ['BEGIN:VTIMEZONE', f"TZID:{name}"]
+    for (kind, offset_from, offset_to, abbreviation), times in observances.items():
+        lines.append(f"BEGIN:{kind}")
+        lines.append(f"DTSTART:{times[0]}")
+        if len(times) > 1:
+            lines.append(f"RDATE:{','.join(times[1:])}")
+        lines.append(f"TZOFFSETFROM:{_utc_offset(offset_from)}")
+        lines.append(f"TZOFFSETTO:{_utc_offset(offset_to)}")
+        if abbreviation:
+            lines.append(f"TZNAME:{abbreviation}")
+        lines.append(f"END:{kind}")
+    lines.append('END:VTIMEZONE')
+    return ''.join(_ics_fold(line) for line in lines)
+
+def _series_uid(service, calendar_id: str, event: dict, uids: dict):
+    """iCalUID of the series a cancelled instance belongs to, or None"""
+    master_id = event.get('recurringEventId')
+    if not master_id:
+        return None
+    if master_id not in uids:
+        try:
+            uids[master_id] = service.events().get(
+                calendarId=calendar_id, eventId=master_id, fields='iCalUID'
+            ).execute()['iCalUID']
+        except HttpError:
+            uids[master_id] = None
+    return uids[master_id]
+
+def export_ics(output: str, time_min: datetime = None, time_max: datetime = None,
+               calendar_id: str = 'primary', service=None) -> int:
+    """Stream every event in a range to an .ics file, returning the count
+
+    Recurring series are exported once with their RRULEs, plus their
+    modified or cancelled instances.
+    """
+    output = Path(output)
+    service = service or get_calendar_service()
+    checkpoint = Checkpoint(output, {
+        'kind': 'ics',
+        'calendar_id': calendar_id,
+        'time_min': time_min.isoformat() if time_min else None,
+        'time_max': time_max.isoformat() if time_max else None,
+    })
+    state = checkpoint.state or {'page_token': None, 'count': 0, 'zones': {}}
+    page_token = state['page_token']
+    count = state['count']
+    # TZID -> [first year, last year] used, written as VTIMEZONEs at the end
+    zones = state['zones']
+    # iCalUIDs of recurring series, by event ID
+    uids = {}
+
+    with _open_output(output, checkpoint) as out:
+        if checkpoint.state is None:
+            out.write(b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//google-calendar-mcp//export//EN\r\n')
+
+        while True:
+            params = {
+                'calendarId': calendar_id,
+                'singleEvents': False,
+                'showDeleted': False,
+                'maxResults': 2500,
+                'pageToken': page_token,
+            }
+            if time_min:
+                params['timeMin'] = time_min.isoformat()
+            if time_max:
+                params['timeMax'] = time_max.isoformat()
+            result = service.events().list(**params).execute()
+
+            for event in result.get('items', []):
+                if event.get('recurrence') and event.get('iCalUID'):
+                    uids[event['id']] = event['iCalUID']
+                uid = event.get('iCalUID') or _series_uid(service, calendar_id, event, uids)
+                out.write(event_to_ics(event, uid, zones).encode('utf-8'))
+                count += 1
+
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+            out.flush()
+            checkpoint.save(page_token=page_token, count=count, zones=zones, offset=out.tell())
+            _progress(f"{count} events exported")
+
+        # Recurring series run on past the last event, so cover a few years more
+        last_year = datetime.now(timezone.utc).year + VTIMEZONE_YEARS_AHEAD
+        for name, (first, last) in sorted(zones.items()):
+            try:
+                out.write(vtimezone(name, first, max(last, last_year)).encode('utf-8'))
+            except (ValueError, KeyError) as e:
+                _progress(f"No VTIMEZONE for {name}: {e}")
+        out.write(b'END:VCALENDAR\r\n')
+
+    checkpoint.clear()
+    return count
+
+# mbox
+
+_FROM_LINE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+def message_to_mbox(message: dict) -> bytes:
+    """Render a raw-format Gmail message as an mboxrd entry"""
+    raw = base64.urlsafe_b64decode(message['raw'])
+    raw = raw.replace(b'\r\n', b'\n')
+    received = datetime.fromtimestamp(int(message.get('internalDate', 0)) / 1000, timezone.utc)
+    separator = f"From {message['id']}@gmail {received.strftime('%a %b %d %H:%M:%S %Y')}\n".encode()
+    body = _FROM_LINE.sub(rb'>\1', raw)
+    if not body.endswith(b'\n'):
+        body += b'\n'
+    return separator + body + b'\n'
+
+def _fetch_raw_batch(ids: list[str], service_factory) -> list[dict]:
+    """Fetch raw messages in one batch, in the order given"""
+    found, failed = batch_get_messages(
+        service_factory(), ids, MBOX_RETRIES, format='raw', fields='id,raw,internalDate'
+    )
+    if failed:
+        raise RuntimeError(f"Failed to fetch {len(failed)} messages after {MBOX_RETRIES} retries")
+    return [found[message_id] for message_id in ids]
+
+def export_mbox(output: str, query: str = None, batch_size: int = MBOX_BATCH_SIZE,
+                concurrency: int = MBOX_CONCURRENCY, service_factory=get_gmail_service) -> int:
+    """Stream messages matching a query to an .mbox file, returning the count
+
+    Each page of IDs is fetched in concurrent batches and written in order,
+    holding at most concurrency * batch_size messages in memory.
+    """
+    output = Path(output)
+    batch_size = min(batch_size, GMAIL_BATCH_MAX)
+    service = service_factory()
+    checkpoint = Checkpoint(output, {'kind': 'mbox', 'query': query})
+    state = checkpoint.state or {'page_token': None, 'done_in_page': 0, 'count': 0}
+    page_token = state['page_token']
+    done_in_page = state['done_in_page']
+    count = state['count']
+
+    with _open_output(output, checkpoint) as out, ThreadPoolExecutor(concurrency) as pool:
+        while True:
+            result = service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=500,
+                pageToken=page_token
+            ).execute()
+            ids = [m['id'] for m in result.get('messages', [])]
+
+            step = batch_size * concurrency
+            for start in range(done_in_page, len(ids), step):
+                chunk = ids[start:start + step]
+                batches = [chunk[i:i + batch_size] for i in range(0, len(chunk), batch_size)]
+                for messages in pool.map(lambda b: _fetch_raw_batch(b, service_factory), batches):
+                    for message in messages:
+                        out.write(message_to_mbox(message))
+                count += len(chunk)
+                out.flush()
+                checkpoint.save(
+                    page_token=page_token,
+                    done_in_page=start + len(chunk),
+                    count=count,
+                    offset=out.tell()
+                )
+                _progress(f"{count} messages exported")
+
+            page_token = result.get('nextPageToken')
+            done_in_page = 0
+            if not page_token:
+                break
+            checkpoint.save(page_token=page_token, done_in_page=0, count=count, offset=out.tell())
+
+    checkpoint.clear()
+    return count
@@ -0,0 +1,245 @@
+"""Bulk import of .ics files through events.import"""
+import re
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+from .deadlines import execute_request
+from .times import get_zone, to_utc
+
+IMPORT_BATCH_SIZE = 50
+
+_DURATION = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+def _unfolded_lines(path: str) -> Iterator[str]:
+    """Yield logical content lines, joining RFC 5545 folded continuations"""
+    current = None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for raw in f:
+            line = raw.rstrip('\r\n')
+            if line[:1] in (' ', '\t') and current is not None:
+                current += line[1:]
+                continue
+            if current is not None:
+                yield current
+            current = line
+    if current:
+        yield current
+
+def _parse_property(line: str) -> tuple[str, dict, str]:
+    """Split 'NAME;PARAM=x:value' into (name, params, value)"""
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return line.upper(), {}, ''
+    name, *params = head.split(';')
+    parsed = {}
+    for param in params:
+        key, _, param_value = param.partition('=')
+        parsed[key.upper()] = param_value.strip('"')
+    return name.upper(), parsed, value
+
+def _unescape(text: str) -> str:
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), text)
+
+def iter_vevents(path: str) -> Iterator[list[tuple[str, dict, str]]]:
+    """Stream the properties of each VEVENT, skipping nested components"""
+    properties = None
+    depth = 0
+    for line in _unfolded_lines(path):
+        name, params, value = _parse_property(line)
+        if name == 'BEGIN':
+            if value.upper() == 'VEVENT' and properties is None:
+                properties = []
+            elif properties is not None:
+                depth += 1
+        elif name == 'END':
+            if properties is not None and depth:
+                depth -= 1
+            elif properties is not None and value.upper() == 'VEVENT':
+                yield properties
+                properties = None
+        elif properties is not None and not depth:
+            properties.append((name, params, value))
+
+def _parse_ics_time(params: dict, value: str, default_timezone: str) -> dict:
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return {'date': f"{value[:4]}-{value[4:6]}-{value[6:8]}"}
+    dt = datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return {'dateTime': dt.isoformat() + 'Z', 'timeZone': 'UTC'}
+    return {'dateTime': dt.isoformat(), 'timeZone': params.get('TZID', default_timezone)}
+
+def _parse_duration(value: str) -> timedelta:
+    match = _DURATION.match(value)
+    if not match:
+        raise ValueError(f"Unsupported DURATION {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+        minutes=int(minutes or 0), seconds=int(seconds or 0)
+    )
+    return -delta if sign == '-' else delta
+
+def _shift(when: dict, delta: timedelta) -> dict:
+    if 'date' in when:
+        day = datetime.fromisoformat(when['date']) + delta
+        return {'date': day.date().isoformat()}
+    shifted = dict(when)
+    value = when['dateTime']
+    suffix = 'Z' if value.endswith('Z') else ''
+    shifted['dateTime'] = (datetime.fromisoformat(value.rstrip('Z')) + delta).isoformat() + suffix
+    return shifted
+
+def vevent_to_event(properties, default_timezone: str = 'UTC') -> dict:
+    """Map VEVENT properties to a Calendar API event for events.import"""
+    event = {}
+    duration = None
+    recurrence = []
+    attendees = []
+    for name, params, value in properties:
+        if name == 'UID':
+            event['iCalUID'] = value
+        elif name == 'SUMMARY':
+            event['summary'] = _unescape(value)
+        elif name == 'DESCRIPTION':
+            event['description'] = _unescape(value)
+        elif name == 'LOCATION':
+            event['location'] = _unescape(value)
+        elif name == 'DTSTART':
+            event['start'] = _parse_ics_time(params, value, default_timezone)
+        elif name == 'DTEND':
+            event['end'] = _parse_ics_time(params, value, default_timezone)
+        elif name == 'DURATION':
+            duration = _parse_duration(value)
+        elif name == 'RECURRENCE-ID':
+            event['originalStartTime'] = _parse_ics_time(params, value, default_timezone)
+        elif name in ('RRULE', 'EXRULE', 'RDATE', 'EXDATE'):
+            param_text = ''.join(f";{k}={v}" for k, v in params.items())
+            recurrence.append(f"{name}{param_text}:{value}")
+        elif name == 'STATUS' and value.upper() in ('CONFIRMED', 'TENTATIVE', 'CANCELLED'):
+            event['status'] = value.lower()
+        elif name == 'TRANSP' and value.upper() == 'TRANSPARENT':
+            event['transparency'] = 'transparent'
+        elif name == 'ORGANIZER' and value.lower().startswith('mailto:'):
+            event['organizer'] = {'email': value[7:]}
+        elif name == 'ATTENDEE' and value.lower().startswith('mailto:'):
+            attendees.append({'email': value[7:]})
+
+    if 'iCalUID' not in event or 'start' not in event:
+        raise ValueError("VEVENT without UID or DTSTART")
+    if 'end' not in event:
+        if duration is None:
+            duration = timedelta(days=1) if 'date' in event['start'] else timedelta(0)
+        event['end'] = _shift(event['start'], duration)
+    if recurrence:
+        event['recurrence'] = recurrence
+    if attendees:
+        event['attendees'] = attendees
+    return event
+
+def _instance_key(uid: str, original_start: dict = None):
+    """Identify a series or a single event, or one modified instance of a series"""
+    if original_start is None:
+        return uid, None
+    if 'date' in original_start:
+        return uid, original_start['date']
+    value = original_start['dateTime']
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=get_zone(original_start.get('timeZone') or 'UTC'))
+    return uid, to_utc(dt).isoformat()
+
+def fetch_existing_keys(service, calendar_id: str) -> set:
+    """Every iCalUID (and modified instance) already on the calendar, in one paged listing"""
+    keys = set()
+    uids = {}
+    # Cancelled instances of a series carry no iCalUID, only their master's ID
+    cancelled = []
+    page_token = None
+    while True:
+        result = execute_request(service.events().list(
+            calendarId=calendar_id,
+            singleEvents=False,
+            showDeleted=False,
+            maxResults=2500,
+            pageToken=page_token,
+            fields='items(id,iCalUID,recurringEventId,originalStartTime),nextPageToken'
+        ))
+        for item in result.get('items', []):
+            if item.get('iCalUID'):
+                uids[item['id']] = item['iCalUID']
+                keys.add(_instance_key(item['iCalUID'], item.get('originalStartTime')))
+            elif item.get('recurringEventId') and item.get('originalStartTime'):
+                cancelled.append(item)
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+
+    for item in cancelled:
+        uid = uids.get(item['recurringEventId'])
+        if uid:
+            keys.add(_instance_key(uid, item['originalStartTime']))
+    return keys
+
+def import_ics(service, path: str, calendar_id: str = 'primary', default_timezone: str = 'UTC',
+               batch_size: int = IMPORT_BATCH_SIZE,
+               progress: Callable[[int, int, int], None] = None) -> dict:
+    """Import a .ics file idempotently, skipping events already on the calendar
+
+    Returns counts of imported, skipped and failed events plus the first
+    few error messages. progress(imported, skipped, failed) is called after
+    every batch.
+    """
+    existing = fetch_existing_keys(service, calendar_id)
+    summary = {'imported': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+    pending = []
+
+    def record_error(message: str):
+        summary['failed'] += 1
+        if len(summary['errors']) < 5:
+            summary['errors'].append(message)
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            summary['imported'] += 1
+        else:
+            record_error(f"{request_id}: {exception}")
+
+    def flush():
+        if not pending:
+            return
+        batch = service.new_batch_http_request(callback=collect)
+        for uid, event in pending:
+            batch.add(
+                service.events().import_(calendarId=calendar_id, body=event, fields='id'),
+                request_id=uid
+            )
+        execute_request(batch)
+        pending.clear()
+        if progress:
+            progress(summary['imported'], summary['skipped'], summary['failed'])
+
+    for properties in iter_vevents(path):
+        try:
+            event = vevent_to_event(properties, default_timezone)
+        except ValueError as e:
+            record_error(str(e))
+            continue
+
+        key = _instance_key(event['iCalUID'], event.get('originalStartTime'))
+        if key in existing:
+            summary['skipped'] += 1
+            continue
+        existing.add(key)
+
+        # Batch request IDs must be unique, so number them per batch
+        pending.append((f"{event['iCalUID']}#{len(pending)}", event))
+        if len(pending) >= batch_size:
+            flush()
+
+    flush()
+    return summary
@@ -0,0 +1,539 @@
+"""Concurrent load generator that replays tool calls against the server
+
+The real server main() is started in a subprocess with its Google services
+swapped for an in-memory fake backend, and driven over stdio by one MCP
+client session issuing many calls at once. Each simulated agent replays a
+trace of tool calls, either synthetic or recorded by a server run with
+CALENDAR_MCP_TRACE set. For every concurrency step the client reports
+throughput and latency percentiles, and the server reports how late its
+event loop ran and how its memory grew.
+"""
+import asyncio
+import base64
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from .output import ERROR_PREFIXES
+
+LOADTEST_CONCURRENCY = (1, 2, 4, 8, 16, 32)
+LOADTEST_STEP_SECONDS = 10.0
+# Round trip added to every fake API call, like a nearby Google frontend
+FAKE_LATENCY_MS = 20.0
+FAKE_EVENTS = 200
+FAKE_MESSAGES = 1000
+LAG_INTERVAL_SECONDS = 0.05
+
+# --- Fake Google backend -------------------------------------------------
+
+def _http_error(status: int, message: str):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    body = json.dumps({'error': {'code': status, 'message': message}}).encode()
+    return HttpError(httplib2.Response({'status': status}), body)
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _event_start(event: dict) -> datetime:
+    return _parse_time(event['start'].get('dateTime') or event['start']['date'])
+
+def _event_end(event: dict) -> datetime:
+    return _parse_time(event['end'].get('dateTime') or event['end']['date'])
+
+class FakeRequest:
+    """Stands in for an HttpRequest: headers plus a blocking execute()"""
+
+    def __init__(self, backend, handler, *args):
+        self.backend = backend
+        self.handler = handler
+        self.args = args
+        self.headers = {}
+
+    def run(self):
+        return copy.deepcopy(self.handler(self.headers, *self.args))
+
+    def execute(self, *args, **kwargs):
+        self.backend.wait()
+        return self.run()
+
+class FakeBatch:
+    """Stands in for a BatchHttpRequest: one round trip for all its requests"""
+
+    def __init__(self, backend, callback):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+
+    def execute(self, *args, **kwargs):
+        self.backend.wait()
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = request.run(), None
+            except Exception as e:
+                response, exception = None, e
+            (callback or self.callback)(request_id, response, exception)
+
+class _Collection:
+    """Resource whose methods build FakeRequests against the backend"""
+
+    def __init__(self, backend, **methods):
+        self._backend = backend
+        self._methods = methods
+
+    def __getattr__(self, name):
+        try:
+            handler = self._methods[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        return lambda **params: FakeRequest(self._backend, handler, params)
+
+class FakeGoogle:
+    """In-memory calendar and mailbox shared by every fake service
+
+    Only as much of the two APIs as the tools use is modelled. Calendar
+    reads honour If-None-Match and writes If-Match. Gmail search queries
+    are not interpreted, and a message ID that was never seeded is
+    generated on first read, so recorded traces from a real mailbox still
+    find their messages.
+    """
+
+    def __init__(self, events: int = FAKE_EVENTS, messages: int = FAKE_MESSAGES,
+                 latency_ms: float = FAKE_LATENCY_MS, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.lock = threading.Lock()
+        self.events = {}
+        self.messages = {}
+        self.sent = 0
+        self._next_id = 0
+        rng = random.Random(seed)
+        day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        for i in range(events):
+            start = day + timedelta(days=rng.randrange(-7, 21), hours=rng.randrange(7, 19),
+                                    minutes=rng.choice((0, 30)))
+            self._add_event(f"evt{i}", {
+                'summary': f"Meeting {i}",
+                'start': {'dateTime': start.isoformat()},
+                'end': {'dateTime': (start + timedelta(minutes=rng.choice((30, 60, 90)))).isoformat()},
+                'attendees': [{'email': f"person{rng.randrange(50)}@example.com"}],
+            })
+        for i in range(messages):
+            self.messages[f"msg{i}"] = self._message(f"msg{i}", rng)
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_id(self, prefix: str) -> str:
+        self._next_id += 1
+        return f"{prefix}-{self._next_id}"
+
+    def _add_event(self, event_id: str, body: dict) -> dict:
+        event = {
+            **body,
+            'id': event_id,
+            'status': 'confirmed',
+            'etag': f'"{time.monotonic_ns()}"',
+            'htmlLink': f"https://calendar.example.com/{event_id}",
+        }
+        self.events[event_id] = event
+        return event
+
+    def _message(self, message_id: str, rng=None) -> dict:
+        rng = rng or random.Random(message_id)
+        sender = f"person{rng.randrange(200)}@{rng.choice(('example.com', 'example.org', 'lists.example.net'))}"
+        text = f"Hello,\n\n{'Lorem ipsum dolor sit amet. ' * rng.randrange(5, 80)}\n\nThanks\n"
+        headers = [
+            {'name': 'From', 'value': sender},
+            {'name': 'To', 'value': 'me@example.com'},
+            {'name': 'Subject', 'value': f"Subject {message_id}"},
+            {'name': 'Date', 'value': 'Mon, 19 Oct 2026 09:00:00 +0000'},
+            {'name': 'Message-ID', 'value': f"<{message_id}@example.com>"},
+        ]
+        if 'lists.' in sender:
+            headers.append({'name': 'List-Unsubscribe', 'value': f"<mailto:unsubscribe@{sender.split('@')[1]}>"})
+        return {
+            'id': message_id,
+            'threadId': f"thread-{sum(map(ord, message_id)) % 300}",
+            'labelIds': ['INBOX'] + (['UNREAD'] if rng.random() < 0.3 else []),
+            'internalDate': str(int(time.time() * 1000) - rng.randrange(10 ** 10)),
+            'snippet': text[:100],
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': headers,
+                'body': {'data': base64.urlsafe_b64encode(text.encode()).decode()},
+            },
+        }
+
+    # Calendar
+
+    def calendar(self):
+        return _FakeService(
+            self,
+            events=_Collection(
+                self,
+                list=self._list_events,
+                get=self._get_event,
+                insert=self._insert_event,
+                import_=self._insert_event,
+                patch=self._patch_event,
+                delete=self._delete_event,
+            ),
+            calendarList=_Collection(self, list=lambda headers, params: {'items': [{'id': 'primary'}]}),
+            settings=_Collection(self, get=lambda headers, params: {'value': 'UTC'}),
+            freebusy=_Collection(self, query=self._freebusy),
+        )
+
+    def _list_events(self, headers, params):
+        time_min = _parse_time(params['timeMin']) if params.get('timeMin') else None
+        time_max = _parse_time(params['timeMax']) if params.get('timeMax') else None
+        query = (params.get('q') or '').lower()
+        with self.lock:
+            events = list(self.events.values())
+        items = [
+            event for event in events
+            if (time_min is None or _event_end(event) > time_min)
+            and (time_max is None or _event_start(event) < time_max)
+            and query in event.get('summary', '').lower()
+        ]
+        items.sort(key=_event_start)
+        return {'items': items[:params.get('maxResults') or 250]}
+
+    def _get_event(self, headers, params):
+        event = self.events.get(params['eventId'])
+        if event is None:
+            raise _http_error(404, 'Not Found')
+        if headers.get('If-None-Match') == event['etag']:
+            raise _http_error(304, 'Not Modified')
+        return event
+
+    def _insert_event(self, headers, params):
+        with self.lock:
+            return self._add_event(self._new_id('evt'), params['body'])
+
+    def _patch_event(self, headers, params):
+        with self.lock:
+            event = self.events.get(params['eventId'])
+            if event is None:
+                raise _http_error(404, 'Not Found')
+            if headers.get('If-Match') not in (None, event['etag']):
+                raise _http_error(412, 'Precondition Failed')
+            return self._add_event(event['id'], {**event, **params['body']})
+
+    def _delete_event(self, headers, params):
+        with self.lock:
+            if self.events.pop(params['eventId'], None) is None:
+                raise _http_error(410, 'Resource has been deleted')
+        return ''
+
+    def _freebusy(self, headers, params):
+        body = params['body']
+        time_min, time_max = _parse_time(body['timeMin']), _parse_time(body['timeMax'])
+        busy = [
+            {'start': _event_start(event).isoformat(), 'end': _event_end(event).isoformat()}
+            for event in list(self.events.values())
+            if _event_end(event) > time_min and _event_start(event) < time_max
+        ]
+        return {'calendars': {
+            item['id']: {'busy': busy if item['id'] in ('primary', 'me@example.com') else []}
+            for item in body['items']
+        }}
+
+    # Gmail
+
+    def gmail(self):
+        return _FakeService(self, users=lambda: _FakeService(
+            self,
+            messages=_Collection(
+                self,
+                list=self._list_messages,
+                get=self._get_message,
+                send=self._send_message,
+                modify=lambda headers, params: self._get_message(headers, params),
+                trash=lambda headers, params: self._get_message(headers, params),
+                delete=lambda headers, params: '',
+            ),
+            threads=_Collection(self, list=self._list_threads, get=self._get_thread),
+            labels=_Collection(self, list=lambda headers, params: {'labels': [
+                {'id': 'INBOX', 'name': 'INBOX', 'type': 'system'},
+                {'id': 'UNREAD', 'name': 'UNREAD', 'type': 'system'},
+                {'id': 'Label_1', 'name': 'Work', 'type': 'user'},
+            ]}),
+            drafts=_Collection(self, create=lambda headers, params: {'id': self._new_id('draft')}),
+        ))
+
+    def _page(self, items: list, params: dict, key: str) -> dict:
+        start = int(params.get('pageToken') or 0)
+        size = params.get('maxResults') or 100
+        page = {key: items[start:start + size], 'resultSizeEstimate': len(items)}
+        if start + size < len(items):
+            page['nextPageToken'] = str(start + size)
+        return page
+
+    def _list_messages(self, headers, params):
+        messages = [{'id': m['id'], 'threadId': m['threadId']} for m in list(self.messages.values())]
+        return self._page(messages, params, 'messages')
+
+    def _get_message(self, headers, params):
+        message_id = params['id']
+        if message_id not in self.messages:
+            with self.lock:
+                self.messages.setdefault(message_id, self._message(message_id))
+        return self.messages[message_id]
+
+    def _send_message(self, headers, params):
+        with self.lock:
+            self.sent += 1
+            return {'id': self._new_id('sent'), 'labelIds': ['SENT']}
+
+    def _list_threads(self, headers, params):
+        threads = sorted({m['threadId'] for m in list(self.messages.values())})
+        return self._page([{'id': thread_id} for thread_id in threads], params, 'threads')
+
+    def _get_thread(self, headers, params):
+        messages = [m for m in list(self.messages.values()) if m['threadId'] == params['id']]
+        return {'id': params['id'], 'messages': messages}
+
+class _FakeService:
+    """Top-level service object with batch support"""
+
+    def __init__(self, backend, **collections):
+        self._backend = backend
+        self._collections = collections
+
+    def __getattr__(self, name):
+        try:
+            collection = self._collections[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        return collection if callable(collection) else (lambda: collection)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self._backend, callback)
+
+# --- Server side ---------------------------------------------------------
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # Peak rather than current, on platforms without /proc
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+async def _sample_loop(stats_path: str):
+    """Write how late each timer fired and the current RSS as JSON lines"""
+    buffered = []
+    flushed_at = time.monotonic()
+    with open(stats_path, 'a', encoding='utf-8') as stats:
+        while True:
+            expected = time.monotonic() + LAG_INTERVAL_SECONDS
+            await asyncio.sleep(LAG_INTERVAL_SECONDS)
+            now = time.monotonic()
+            buffered.append(json.dumps({'time': time.time(), 'lag': max(0.0, now - expected), 'rss': _rss_bytes()}))
+            if now - flushed_at >= 0.5:
+                stats.write('\n'.join(buffered) + '\n')
+                stats.flush()
+                buffered.clear()
+                flushed_at = now
+
+async def _serve_fake(stats_path: str, events: int, messages: int, latency_ms: float):
+    from . import auth
+    backend = FakeGoogle(events, messages, latency_ms)
+    # Every module binds the service factories on import, so swap them first
+    auth.get_calendar_service = backend.calendar
+    auth.get_gmail_service = backend.gmail
+    from .server import main
+
+    sampler = asyncio.get_running_loop().create_task(_sample_loop(stats_path))
+    try:
+        await main()
+    finally:
+        sampler.cancel()
+
+# --- Client side ---------------------------------------------------------
+
+def synthetic_trace(length: int = 500, events: int = FAKE_EVENTS, messages: int = FAKE_MESSAGES,
+                    seed: int = 0) -> list[dict]:
+    """A mix of tool calls resembling an assistant working through a day"""
+    rng = random.Random(seed)
+    day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def slot():
+        start = day + timedelta(days=rng.randrange(1, 14), hours=rng.randrange(8, 18))
+        return start.isoformat(), (start + timedelta(minutes=30)).isoformat()
+
+    def create_event():
+        start, end = slot()
+        return {'summary': f"Load test {rng.randrange(10 ** 6)}", 'start_time': start, 'end_time': end}
+
+    def check_conflicts():
+        start, end = slot()
+        return {'slots': [{'start_time': start, 'end_time': end}]}
+
+    mix = [
+        (20, 'list_events', lambda: {'time_range': rng.choice(('today', 'tomorrow', 'this_week')), 'max_results': 25}),
+        (10, 'get_event', lambda: {'event_id': f"evt{rng.randrange(events)}"}),
+        (4, 'search_events', lambda: {'query': f"Meeting {rng.randrange(events)}"}),
+        (5, 'create_event', create_event),
+        (3, 'update_event', lambda: {'event_id': f"evt{rng.randrange(events)}", 'description': 'Updated by load test'}),
+        (4, 'find_free_slots', lambda: {'duration_minutes': rng.choice((30, 60)), 'days_ahead': 7}),
+        (2, 'check_conflicts', check_conflicts),
+        (12, 'list_emails', lambda: {'max_results': 10}),
+        (15, 'search_emails', lambda: {'query': rng.choice(('from:person1', 'is:unread', 'subject:report')), 'max_results': 10}),
+        (25, 'read_email', lambda: {'email_id': f"msg{min(int(rng.paretovariate(1.2)) - 1, messages - 1)}"}),
+    ]
+    weights = [weight for weight, _, _ in mix]
+    calls = []
+    for _ in range(length):
+        _, tool, arguments = rng.choices(mix, weights)[0]
+        calls.append({'tool': tool, 'arguments': arguments()})
+    return calls
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _is_error(result) -> bool:
+    if result.isError:
+        return True
+    if result.structuredContent is not None:
+        return "error" in result.structuredContent
+    text = result.content[0].text if result.content else ''
+    return text.startswith(ERROR_PREFIXES)
+
+def _read_samples(stats_path: Path, start: float, end: float) -> list[dict]:
+    samples = []
+    with open(stats_path, encoding='utf-8') as stats:
+        for line in stats:
+            sample = json.loads(line)
+            if start <= sample['time'] <= end:
+                samples.append(sample)
+    return samples
+
+async def _agent(session, calls: list[dict], offset: int, stop_at: float, latencies: list, errors: list):
+    """Replay calls in order, starting at offset, until the step ends"""
+    i = offset
+    while time.monotonic() < stop_at:
+        call = calls[i % len(calls)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            result = await session.call_tool(call['tool'], call['arguments'])
+            failed = _is_error(result)
+        except Exception as e:
+            failed = True
+            print(f"{call['tool']} failed: {e}", file=sys.stderr)
+        latencies.append(time.perf_counter() - started)
+        if failed:
+            errors.append(call['tool'])
+
+async def run_load(calls: list[dict], concurrency=LOADTEST_CONCURRENCY,
+                   step_seconds: float = LOADTEST_STEP_SECONDS, events: int = FAKE_EVENTS,
+                   messages: int = FAKE_MESSAGES, latency_ms: float = FAKE_LATENCY_MS,
+                   output_format: str = None, progress=None) -> list[dict]:
+    """Drive the server with each concurrency level in turn
+
+    Returns one dict per step with throughput, latency percentiles in
+    milliseconds, event-loop lag and RSS growth since warm-up.
+    """
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    if output_format:
+        calls = [{**call, 'arguments': {**call['arguments'], 'format': output_format}} for call in calls]
+
+    with tempfile.TemporaryDirectory(prefix='calendar-mcp-loadtest-') as workdir:
+        workdir = Path(workdir)
+        stats_path = workdir / 'stats.jsonl'
+        stats_path.touch()
+        env = {
+            key: value for key, value in os.environ.items()
+            if key not in ('CALENDAR_MCP_PUSH_ADDRESS', 'CALENDAR_MCP_TRACE')
+        }
+        # Keep the run's caches and outbox away from the real ones
+        env['CALENDAR_MCP_OUTBOX'] = str(workdir / 'outbox.db')
+        env['CALENDAR_MCP_RESOURCE_CACHE'] = str(workdir / 'resources.db')
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(Path(__file__).parent.parent), env.get('PYTHONPATH')]))
+        server = StdioServerParameters(
+            command=sys.executable,
+            args=['-m', 'calendar_mcp.loadtest', str(stats_path), str(events), str(messages), str(latency_ms)],
+            env=env
+        )
+
+        results = []
+        async with stdio_client(server) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                await session.list_tools()
+                # One call of each tool so imports and first-use caches are not measured
+                for call in {call['tool']: call for call in calls}.values():
+                    await session.call_tool(call['tool'], call['arguments'])
+                await asyncio.sleep(1)
+                warm = _read_samples(stats_path, 0, time.time())
+                baseline = warm[-1]['rss'] if warm else 0
+
+                for level in concurrency:
+                    latencies, errors = [], []
+                    started_at = time.time()
+                    started = time.monotonic()
+                    stop_at = started + step_seconds
+                    await asyncio.gather(*(
+                        _agent(session, calls, agent * len(calls) // level, stop_at, latencies, errors)
+                        for agent in range(level)
+                    ))
+                    elapsed = time.monotonic() - started
+                    # Let the sampler flush the end of the step
+                    await asyncio.sleep(0.6)
+                    samples = _read_samples(stats_path, started_at, started_at + elapsed)
+                    lags = sorted(sample['lag'] for sample in samples)
+                    latencies.sort()
+                    rss = samples[-1]['rss'] if samples else 0
+                    step = {
+                        'concurrency': level,
+                        'calls': len(latencies),
+                        'errors': len(errors),
+                        'throughput': len(latencies) / elapsed,
+                        'p50_ms': _percentile(latencies, 0.50) * 1000,
+                        'p95_ms': _percentile(latencies, 0.95) * 1000,
+                        'p99_ms': _percentile(latencies, 0.99) * 1000,
+                        'max_ms': (latencies[-1] if latencies else 0) * 1000,
+                        'lag_p99_ms': _percentile(lags, 0.99) * 1000,
+                        'lag_max_ms': (lags[-1] if lags else 0) * 1000,
+                        'rss_mb': rss / 2 ** 20,
+                        'rss_growth_mb': (rss - baseline) / 2 ** 20,
+                    }
+                    results.append(step)
+                    if progress:
+                        progress(step)
+        return results
+
+def format_step(step: dict) -> str:
+    return (
+        f"{step['concurrency']:>5} {step['calls']:>7} {step['throughput']:>9.1f} "
+        f"{step['p50_ms']:>8.1f} {step['p95_ms']:>8.1f} {step['p99_ms']:>8.1f} {step['errors']:>6} "
+        f"{step['lag_p99_ms']:>8.1f} {step['lag_max_ms']:>8.1f} {step['rss_mb']:>8.1f} {step['rss_growth_mb']:>+8.1f}"
+    )
+
+STEP_HEADER = (
+    f"{'conc':>5} {'calls':>7} {'calls/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} "
+    f"{'lag p99':>8} {'lag max':>8} {'rss MB':>8} {'growth':>8}"
+)
+
+if __name__ == "__main__":
+    # Server half of a load test, started by run_load()
+    stats_path, events, messages, latency_ms = sys.argv[1:5]
+    asyncio.run(_serve_fake(stats_path, int(events), int(messages), float(latency_ms)))
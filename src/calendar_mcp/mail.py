@@ -0,0 +1,90 @@
+"""Helpers for reading Gmail message payloads"""
+import base64
+import re
+import time
+from .deadlines import execute_request
+
+# Gmail rejects batch requests with more than 100 calls
+GMAIL_BATCH_MAX = 100
+
+BATCH_RETRIES = 3
+
+OUTLOOK_HEADER = re.compile(r'^(From|Sent|To|Cc|Date|Subject):')
+
+def get_headers(message: dict) -> dict:
+    """Map header names to values for a message resource"""
+    return {h['name']: h['value'] for h in message.get('payload', {}).get('headers', [])}
+
+def extract_text(payload: dict) -> str:
+    """Return the first text/plain body in a payload, searching nested parts"""
+    if payload.get('mimeType') == 'text/plain' and 'data' in payload.get('body', {}):
+        return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='replace')
+    for part in payload.get('parts', []):
+        text = extract_text(part)
+        if text:
+            return text
+    if 'parts' not in payload and 'data' in payload.get('body', {}):
+        return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='replace')
+    return ""
+
+def _normalize(line: str) -> str:
+    return line.lstrip('> ').strip()
+
+def strip_quoted(body: str, seen_lines: set) -> str:
+    """Drop the trailing quote of earlier messages from a reply
+
+    The trailing run of blank, '>'-quoted or previously seen lines is cut,
+    along with the "On ... wrote:" attribution above it. The body is kept
+    whole if nothing new would remain.
+    """
+    lines = body.splitlines()
+    cut = len(lines)
+    while cut > 0:
+        line = lines[cut - 1].strip()
+        if not line or line.startswith('>') or _normalize(line) in seen_lines:
+            cut -= 1
+        else:
+            break
+
+    if cut < len(lines):
+        # Attribution lines may wrap, e.g. "On Mon, ... <a@b.com>\nwrote:"
+        if cut > 0 and lines[cut - 1].strip().endswith('wrote:'):
+            cut -= 1
+            if cut > 0 and lines[cut].strip() == 'wrote:':
+                cut -= 1
+        else:
+            # Outlook-style header block above the quoted message
+            while cut > 0 and OUTLOOK_HEADER.match(lines[cut - 1].strip()):
+                cut -= 1
+            if cut > 0 and lines[cut - 1].strip() == '-----Original Message-----':
+                cut -= 1
+
+    kept = "\n".join(lines[:cut]).rstrip()
+    return kept if kept else body.rstrip()
+
+def batch_get_messages(service, ids: list[str], retries: int = BATCH_RETRIES, **params) -> tuple[dict, list[str]]:
+    """Fetch messages with one batched request, retrying the calls that fail
+
+    Failed calls are usually rate limited, so each retry waits twice as
+    long. Returns (messages by ID, IDs that still failed).
+    """
+    found = {}
+    pending = list(ids)
+    for attempt in range(retries + 1):
+        failed = []
+
+        def collect(request_id, response, exception):
+            if exception is None:
+                found[request_id] = response
+            else:
+                failed.append(request_id)
+
+        batch = service.new_batch_http_request(callback=collect)
+        for message_id in pending:
+            batch.add(service.users().messages().get(userId='me', id=message_id, **params), request_id=message_id)
+        execute_request(batch)
+
+        if not failed or attempt == retries:
+            return found, failed
+        pending = failed
+        time.sleep(2 ** attempt)
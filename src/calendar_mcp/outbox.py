@@ -0,0 +1,231 @@
+"""Durable outbound mail queue drained by a rate-limited background worker
+
+Queued sends and drafts are stored in SQLite under an idempotency key, so
+retrying a tool call cannot queue the same message twice. Each message
+carries its own Message-ID. Before a failed send is retried, and for a
+message that was being sent when the server stopped, Gmail is searched for
+that ID, so a message is only sent again if Gmail never received it.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from pathlib import Path
+from googleapiclient.errors import HttpError
+from .auth import get_gmail_service
+from .deadlines import execute_request
+
+OUTBOX_PATH = Path(os.environ.get(
+    'CALENDAR_MCP_OUTBOX', Path.home() / '.google-calendar-mcp' / 'outbox.db'
+))
+# Gmail allows bursts but throttles sustained sending
+OUTBOX_RATE_PER_MINUTE = float(os.environ.get('CALENDAR_MCP_OUTBOX_RATE', '20'))
+OUTBOX_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    body TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    result_id TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        if error.resp.status in RETRYABLE_STATUSES:
+            return True
+        return error.resp.status == 403 and any(
+            detail.get('reason') in RETRYABLE_REASONS for detail in (error.error_details or [])
+            if isinstance(detail, dict)
+        )
+    # Timeouts and dropped connections
+    return isinstance(error, OSError)
+
+class Outbox:
+    """SQLite-backed queue of sends and drafts"""
+
+    def __init__(self, path: Path = OUTBOX_PATH, rate_per_minute: float = OUTBOX_RATE_PER_MINUTE,
+                 service_factory=get_gmail_service):
+        self.path = Path(path)
+        self.interval = 60 / rate_per_minute
+        self.service_factory = service_factory
+        self._db = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(SCHEMA)
+            self._db.commit()
+        return self._db
+
+    def enqueue(self, kind: str, body: dict, message_id: str, summary: str,
+                idempotency_key: str = None) -> tuple[sqlite3.Row, bool]:
+        """Queue a 'send' or 'draft', returning (row, created)
+
+        An existing entry with the same idempotency key is returned as is.
+        """
+        key = idempotency_key or uuid.uuid4().hex
+        existing = self.db.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+        if existing is not None:
+            return existing, False
+
+        now = time.time()
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO outbox "
+                "(idempotency_key, kind, body, message_id, summary, next_attempt, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(body), message_id, summary, now, now, now)
+            )
+        self.start()
+        self._wake.set()
+        return self.get(cursor.lastrowid), True
+
+    def get(self, queue_id: int):
+        return self.db.execute("SELECT * FROM outbox WHERE id = ?", (queue_id,)).fetchone()
+
+    def recent(self, limit: int = 20) -> list[sqlite3.Row]:
+        return self.db.execute("SELECT * FROM outbox ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+    def counts(self) -> dict:
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def _update(self, queue_id: int, **fields):
+        fields['updated'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self.db:
+            self.db.execute(
+                f"UPDATE outbox SET {assignments} WHERE id = ?", (*fields.values(), queue_id)
+            )
+
+    def _deliver(self, row: sqlite3.Row) -> str:
+        """Send or create the draft for one entry, returning the Gmail ID"""
+        service = self.service_factory()
+        body = json.loads(row['body'])
+        if row['kind'] == 'draft':
+            return execute_request(service.users().drafts().create(userId='me', body=body))['id']
+        return execute_request(service.users().messages().send(userId='me', body=body))['id']
+
+    def _find_delivered(self, row: sqlite3.Row):
+        """Gmail ID of a message already carrying this entry's Message-ID, or None"""
+        service = self.service_factory()
+        result = execute_request(service.users().messages().list(
+            userId='me',
+            q=f"rfc822msgid:{row['message_id']}",
+            includeSpamTrash=True,
+            maxResults=1
+        ))
+        messages = result.get('messages', [])
+        return messages[0]['id'] if messages else None
+
+    async def _recover(self):
+        """Settle entries interrupted mid-send by a previous run"""
+        for row in self.db.execute("SELECT * FROM outbox WHERE status = 'sending'").fetchall():
+            try:
+                delivered = await asyncio.to_thread(self._find_delivered, row)
+            except Exception as e:
+                print(f"Outbox recovery failed for {row['id']}: {e}", file=sys.stderr)
+                continue
+            if delivered:
+                self._update(row['id'], status='sent', result_id=delivered)
+            else:
+                self._update(row['id'], status='queued')
+
+    def _next_due(self):
+        return self.db.execute(
+            "SELECT * FROM outbox WHERE status = 'queued' ORDER BY next_attempt, id LIMIT 1"
+        ).fetchone()
+
+    def _failed_attempt(self, row: sqlite3.Row, attempts: int, error: Exception):
+        if _is_retryable(error) and attempts < OUTBOX_MAX_ATTEMPTS:
+            delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+            self._update(row['id'], status='queued', next_attempt=time.time() + delay, error=str(error))
+        else:
+            self._update(row['id'], status='failed', error=str(error))
+
+    async def _process(self, row: sqlite3.Row):
+        attempts = row['attempts'] + 1
+        # Marked before sending so a crash leaves a trace to recover from
+        self._update(row['id'], status='sending', attempts=attempts)
+        if attempts > 1:
+            # A timeout or dropped connection can follow Gmail accepting the
+            # message, so look for it before sending again
+            try:
+                delivered = await asyncio.to_thread(self._find_delivered, row)
+            except Exception as e:
+                self._failed_attempt(row, attempts, e)
+                return
+            if delivered:
+                self._update(row['id'], status='sent', result_id=delivered, error=None)
+                return
+        try:
+            result_id = await asyncio.to_thread(self._deliver, row)
+        except Exception as e:
+            self._failed_attempt(row, attempts, e)
+            return
+        self._update(row['id'], status='sent', result_id=result_id, error=None)
+
+    async def _run(self):
+        await self._recover()
+        while True:
+            self._wake.clear()
+            row = self._next_due()
+            if row is None:
+                await self._wake.wait()
+                continue
+            wait = row['next_attempt'] - time.time()
+            if wait > 0:
+                # A new entry may be due sooner than the next retry
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(row)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the worker; called on startup and by the first enqueue"""
+        if self._task is None:
+            # Fresh context so the worker is not bound to the deadline of the call that started it
+            # (create_task's context argument needs Python 3.11)
+            self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+outbox = Outbox()
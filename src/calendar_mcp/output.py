@@ -0,0 +1,133 @@
+"""Tool results as readable text or compact structured output
+
+Handlers describe a result as records with stable field names plus a
+function that renders one record as text. With format="json" the records
+are returned as JSON lines and as MCP structured content instead. Either
+way the output is joined once, and max_tokens drops whole trailing
+records rather than cutting one in half.
+"""
+import json
+from typing import Callable
+from mcp.types import TextContent
+
+FORMATS = ("text", "json")
+# How handlers and dispatch_tool begin a failure message
+ERROR_PREFIXES = ("❌", "Error:", "Unknown tool")
+# Rough size of a token for English text and JSON
+CHARS_PER_TOKEN = 4
+
+OUTPUT_PROPERTIES = {
+    "format": {
+        "type": "string",
+        "enum": list(FORMATS),
+        "description": "text for readable output, json for compact JSON lines plus structured content (default: text)",
+        "default": "text"
+    },
+    "max_tokens": {
+        "type": "number",
+        "description": "Approximate token budget; trailing results past it are left out (optional)"
+    }
+}
+
+def add_output_options(tools: list) -> list:
+    """Give every tool the format and max_tokens parameters"""
+    for tool in tools:
+        tool.inputSchema.setdefault("properties", {}).update(OUTPUT_PROPERTIES)
+    return tools
+
+def _is_json(args) -> bool:
+    return (args or {}).get("format") == "json"
+
+def _budget(args):
+    max_tokens = (args or {}).get("max_tokens")
+    return int(max_tokens) * CHARS_PER_TOKEN if max_tokens else None
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+def render(args, records: list[dict], line: Callable[[dict], str], header: str = "",
+           footer: str = "", empty: str = None, **meta):
+    """Render records for a tool call within its token budget
+
+    In text mode the header, one line() per record and the footer are
+    joined once; empty replaces everything when there are no records. In
+    JSON mode meta and the records become JSON lines and the same data
+    is returned as structured content.
+    """
+    budget = _budget(args)
+
+    if _is_json(args):
+        lines = [_dumps(meta)] if meta else []
+        used = sum(len(part) + 1 for part in lines)
+        kept = []
+        for record in records:
+            encoded = _dumps(record)
+            if budget is not None and kept and used + len(encoded) + 1 > budget:
+                break
+            lines.append(encoded)
+            kept.append(record)
+            used += len(encoded) + 1
+        structured = {**meta, "items": kept}
+        if len(kept) < len(records):
+            structured["truncated"] = len(records) - len(kept)
+            lines.append(_dumps({"truncated": structured["truncated"]}))
+        return [TextContent(type="text", text="\n".join(lines))], structured
+
+    if not records and empty is not None:
+        return [TextContent(type="text", text=empty)]
+
+    parts = [header]
+    used = len(header) + len(footer)
+    shown = 0
+    for record in records:
+        text = line(record)
+        if budget is not None and shown and used + len(text) > budget:
+            break
+        parts.append(text)
+        used += len(text)
+        shown += 1
+    parts.append(footer)
+    if shown < len(records):
+        parts.append(f"\n[... {len(records) - shown} more not shown]")
+    return [TextContent(type="text", text="".join(parts))]
+
+def render_one(args, text: str, **fields):
+    """A single result: text as given, or fields in JSON mode"""
+    if _is_json(args):
+        return [TextContent(type="text", text=_dumps(fields))], fields
+    return [TextContent(type="text", text=text)]
+
+def finalize(args, result):
+    """Apply the output options to results not built with render()
+
+    Plain text becomes {"error": ...} in JSON mode when it starts with one
+    of ERROR_PREFIXES and {"message": ...} otherwise. In text mode it is
+    cut at a line boundary to fit max_tokens.
+    """
+    if isinstance(result, tuple) or not result:
+        return result
+    text = result[0].text
+    if _is_json(args):
+        if text.startswith(ERROR_PREFIXES):
+            fields = {"error": text.lstrip("❌ ").removeprefix("Error: ")}
+        else:
+            fields = {"message": text}
+        return render_one(args, text, **fields)
+
+    budget = _budget(args)
+    if budget is not None and len(text) > budget:
+        cut = text.rfind("\n", 0, budget)
+        text = text[:cut if cut > 0 else budget] + "\n[... truncated]"
+        return [TextContent(type="text", text=text)] + list(result[1:])
+    return result
+
+def result_text(result) -> str:
+    """The text of a tool result in either shape"""
+    content = result[0] if isinstance(result, tuple) else result
+    return content[0].text if content else ""
+
+def is_error(result) -> bool:
+    """Whether a tool result in either shape reports a failure"""
+    if isinstance(result, tuple):
+        return "error" in result[1]
+    return result_text(result).startswith(ERROR_PREFIXES)
@@ -0,0 +1,199 @@
+"""Speculative prefetch of message bodies after a listing
+
+Agents usually follow list_emails or search_emails with read_email on the
+top few results. After a listing returns, the first few messages are
+fetched in one batched request in the background, so read_email can answer
+from memory instead of making a second round trip.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import time
+from collections import OrderedDict
+from .auth import get_gmail_service
+from .deadlines import execute_request, latencies
+from .mail import GMAIL_BATCH_MAX
+
+# How many messages of each listing to prefetch; 0 turns prefetching off
+PREFETCH_COUNT = int(os.environ.get('CALENDAR_MCP_PREFETCH', '3'))
+PREFETCH_CACHE_SIZE = int(os.environ.get('CALENDAR_MCP_PREFETCH_CACHE', '50'))
+# Most messages prefetched per minute, so speculation cannot eat the quota
+PREFETCH_BUDGET_PER_MINUTE = int(os.environ.get('CALENDAR_MCP_PREFETCH_BUDGET', '60'))
+PREFETCH_MAX_AGE_SECONDS = 600
+# Longest wait for an in-flight prefetch before enough direct reads were timed
+PREFETCH_WAIT_SECONDS = 0.5
+MESSAGE_GET_METHOD = 'gmail.users.messages.get'
+
+# Only what read_email renders
+MESSAGE_FIELDS = 'id,payload(mimeType,headers,body/data,parts)'
+
+class MessagePrefetcher:
+    """Bounded cache of prefetched messages with hit and waste accounting"""
+
+    def __init__(self, count: int = PREFETCH_COUNT, cache_size: int = PREFETCH_CACHE_SIZE,
+                 budget_per_minute: int = PREFETCH_BUDGET_PER_MINUTE,
+                 service_factory=get_gmail_service):
+        self.count = count
+        self.cache_size = cache_size
+        self.budget_per_minute = budget_per_minute
+        self.service_factory = service_factory
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._tasks = set()
+        self._tokens = float(budget_per_minute)
+        self._refilled_at = time.monotonic()
+        self.prefetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 0 and self.cache_size > 0
+
+    def _take_budget(self, wanted: int) -> int:
+        """Spend up to wanted messages from a token bucket refilled per minute"""
+        now = time.monotonic()
+        self._tokens = min(
+            self.budget_per_minute,
+            self._tokens + (now - self._refilled_at) * self.budget_per_minute / 60
+        )
+        self._refilled_at = now
+        granted = min(wanted, int(self._tokens))
+        self._tokens -= granted
+        return granted
+
+    def _fresh(self, message_id: str) -> bool:
+        entry = self._cache.get(message_id)
+        if entry is None:
+            return False
+        if time.monotonic() - entry[0] > PREFETCH_MAX_AGE_SECONDS:
+            self._evict(message_id)
+            return False
+        return True
+
+    def _evict(self, message_id: str):
+        _, _, was_read = self._cache.pop(message_id)
+        if not was_read:
+            self.wasted += 1
+
+    def _store(self, message_id: str, message: dict):
+        if message_id in self._cache:
+            self._evict(message_id)
+        self._cache[message_id] = (time.monotonic(), message, False)
+        self.prefetched += 1
+        while len(self._cache) > self.cache_size:
+            self._evict(next(iter(self._cache)))
+
+    def schedule(self, message_ids: list[str]):
+        """Start prefetching the first messages of a listing"""
+        if not self.enabled:
+            return
+        wanted = [
+            message_id for message_id in message_ids[:self.count]
+            if message_id not in self._in_flight and not self._fresh(message_id)
+        ]
+        wanted = wanted[:self._take_budget(len(wanted))]
+        if not wanted:
+            return
+
+        # Run outside the listing's deadline, which ends when it returns; the
+        # task copies the empty context it is created in (create_task's
+        # context argument needs Python 3.11)
+        task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._prefetch(wanted))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        for message_id in wanted:
+            self._in_flight[message_id] = task
+
+    async def _prefetch(self, message_ids: list[str]):
+        try:
+            messages = await asyncio.to_thread(self._fetch_batch, message_ids)
+        except Exception as e:
+            print(f"Prefetch failed: {e}", file=sys.stderr)
+            return
+        finally:
+            for message_id in message_ids:
+                self._in_flight.pop(message_id, None)
+        for message_id, message in messages.items():
+            self._store(message_id, message)
+
+    def _fetch_batch(self, message_ids: list[str]) -> dict:
+        service = self.service_factory()
+        found = {}
+
+        def collect(request_id, response, exception):
+            if exception is None:
+                found[request_id] = response
+
+        for i in range(0, len(message_ids), GMAIL_BATCH_MAX):
+            batch = service.new_batch_http_request(callback=collect)
+            for message_id in message_ids[i:i + GMAIL_BATCH_MAX]:
+                batch.add(
+                    service.users().messages().get(
+                        userId='me', id=message_id, format='full', fields=MESSAGE_FIELDS
+                    ),
+                    request_id=message_id
+                )
+            execute_request(batch)
+        return found
+
+    async def get(self, message_id: str):
+        """A prefetched message, briefly waiting for one still in flight, or None
+
+        A batch still running after about as long as a direct fetch usually
+        takes is left to finish in the background, and None is returned.
+        """
+        task = self._in_flight.get(message_id)
+        if task is not None:
+            wait = latencies.p95(MESSAGE_GET_METHOD) or PREFETCH_WAIT_SECONDS
+            try:
+                await asyncio.wait_for(asyncio.shield(task), wait)
+            except asyncio.TimeoutError:
+                pass
+        if not self._fresh(message_id):
+            if self.enabled:
+                self.misses += 1
+            return None
+        stored_at, message, _ = self._cache[message_id]
+        self._cache[message_id] = (stored_at, message, True)
+        self._cache.move_to_end(message_id)
+        self.hits += 1
+        return message
+
+    def discard(self, message_id: str):
+        """Forget a message that was deleted or trashed"""
+        if message_id in self._cache:
+            self._evict(message_id)
+
+    def stats(self) -> dict:
+        reads = self.hits + self.misses
+        return {
+            'prefetched': self.prefetched,
+            'hits': self.hits,
+            'misses': self.misses,
+            'wasted': self.wasted,
+            'hit_ratio': self.hits / reads if reads else 0.0,
+            'waste_ratio': self.wasted / self.prefetched if self.prefetched else 0.0,
+        }
+
+    async def stop(self):
+        """Cancel outstanding prefetches and report how well they paid off"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if not self.enabled or not self.prefetched:
+            return
+        # Anything never read by now was fetched for nothing
+        unread = sum(1 for _, _, was_read in self._cache.values() if not was_read)
+        stats = self.stats()
+        waste_ratio = (stats['wasted'] + unread) / stats['prefetched']
+        print(
+            f"Prefetch: {stats['prefetched']} messages, {stats['hits']} hits, "
+            f"{stats['misses']} misses, hit ratio {stats['hit_ratio']:.0%}, "
+            f"waste ratio {waste_ratio:.0%}",
+            file=sys.stderr
+        )
+
+prefetcher = MessagePrefetcher()
@@ -0,0 +1,402 @@
+"""Push notifications for Calendar and Gmail changes
+
+Calendar changes arrive through events.watch channels and Gmail changes
+through users.watch, whose Pub/Sub push subscription is pointed at the same
+endpoint. Each notification triggers an incremental sync and drops only the
+cached tool results that the change can affect.
+"""
+import asyncio
+import base64
+import json
+import os
+import secrets
+import sys
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+from googleapiclient.errors import HttpError
+from .auth import get_calendar_service, get_gmail_service
+from .conflicts import conflict_indexes
+from .output import is_error
+
+# Public HTTPS URL that forwards to the local receiver; push is off without it
+PUSH_ADDRESS = os.environ.get('CALENDAR_MCP_PUSH_ADDRESS')
+PUSH_HOST = os.environ.get('CALENDAR_MCP_PUSH_HOST', '127.0.0.1')
+PUSH_PORT = int(os.environ.get('CALENDAR_MCP_PUSH_PORT', '8765'))
+# Pub/Sub topic for Gmail users.watch, e.g. projects/my-project/topics/gmail
+GMAIL_TOPIC = os.environ.get('CALENDAR_MCP_GMAIL_TOPIC')
+# Shared secret the Pub/Sub push subscription sends as ?token=; required for Gmail push
+PUSH_SECRET = os.environ.get('CALENDAR_MCP_PUSH_SECRET')
+# Calendar notifications have no body and Pub/Sub envelopes are small
+MAX_NOTIFICATION_BYTES = 64 * 1024
+
+CHANNEL_TTL_SECONDS = 7 * 24 * 3600
+RENEW_MARGIN_SECONDS = 3600
+RENEW_CHECK_SECONDS = 60
+# Upper bound on cache age, since some listings depend on the current time
+CACHE_MAX_AGE_SECONDS = int(os.environ.get('CALENDAR_MCP_CACHE_MAX_AGE', '300'))
+
+CACHEABLE_TOOLS = {
+    "list_events", "get_event", "search_events", "find_free_slots",
+    "list_emails", "search_emails", "read_email", "list_labels",
+    "list_threads", "read_thread", "analyze_mailbox",
+}
+MUTATING_TOOLS = {
+    "create_event", "update_event", "delete_event", "import_ics",
+    "send_email", "mark_email", "delete_email", "reply_to_email", "create_draft", "add_label",
+}
+
+class ReadCache:
+    """Tool results cached per namespace until a change invalidates them"""
+
+    def __init__(self, max_age: float = CACHE_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._entries = {'calendar': {}, 'gmail': {}}
+
+    @staticmethod
+    def _key(name: str, arguments: dict) -> str:
+        return name + json.dumps(arguments or {}, sort_keys=True, default=str)
+
+    def get(self, namespace: str, name: str, arguments: dict):
+        """Return a cached result or None"""
+        key = self._key(name, arguments)
+        entry = self._entries[namespace].get(key)
+        if entry is None:
+            return None
+        stored_at, _, value = entry
+        if time.monotonic() - stored_at > self.max_age:
+            del self._entries[namespace][key]
+            return None
+        return value
+
+    def put(self, namespace: str, name: str, arguments: dict, value, resource_id: str = None):
+        """Cache a result, optionally tied to a single resource ID"""
+        key = self._key(name, arguments)
+        self._entries[namespace][key] = (time.monotonic(), resource_id, value)
+
+    def invalidate(self, namespace: str, resource_ids=None):
+        """Drop a whole namespace, or the given resources plus all listings"""
+        if resource_ids is None:
+            self._entries[namespace].clear()
+            return
+        resource_ids = set(resource_ids)
+        self._entries[namespace] = {
+            key: entry for key, entry in self._entries[namespace].items()
+            if entry[1] is not None and entry[1] not in resource_ids
+        }
+
+class PushReceiver:
+    """Minimal local HTTP endpoint for notification POSTs"""
+
+    def __init__(self, handler, host: str = PUSH_HOST, port: int = PUSH_PORT):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self) -> int:
+        """Start listening and return the bound port"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        """Stop accepting notifications"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        status = "200 OK"
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            body = b""
+            length = int(headers.get('content-length', 0))
+            if len(request_line) < 2 or request_line[0] != 'POST':
+                status = "405 Method Not Allowed"
+            elif length > MAX_NOTIFICATION_BYTES:
+                status = "413 Payload Too Large"
+            else:
+                if length:
+                    body = await reader.readexactly(length)
+                await self.handler(request_line[1], headers, body)
+        except PermissionError:
+            status = "403 Forbidden"
+        except Exception as e:
+            print(f"Push notification failed: {e}", file=sys.stderr)
+            status = "400 Bad Request"
+
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+class PushManager:
+    """Owns watch channels, their renewal and the cache they keep fresh"""
+
+    def __init__(self, address: str, gmail_topic: str = None, calendar_ids=('primary',),
+                 secret: str = PUSH_SECRET):
+        self.address = address
+        self.gmail_topic = gmail_topic
+        self.secret = secret
+        self.calendar_ids = list(calendar_ids)
+        self.cache = ReadCache()
+        self.receiver = PushReceiver(self.handle_notification)
+        self.channels = {}
+        self.sync_tokens = {}
+        self.gmail_history_id = None
+        self.gmail_expiration = None
+        self._renew_task = None
+
+    def watching(self, namespace: str) -> bool:
+        """Whether notifications currently keep this namespace fresh"""
+        now_ms = time.time() * 1000
+        if namespace == 'gmail':
+            return self.gmail_expiration is not None and self.gmail_expiration > now_ms
+        return any(channel['expiration'] > now_ms for channel in self.channels.values())
+
+    def watching_calendars(self, calendar_ids) -> bool:
+        """Whether every calendar named by a calendar_ids or calendar_id argument has a live channel"""
+        if not calendar_ids:
+            calendar_ids = ['primary']
+        elif isinstance(calendar_ids, str):
+            calendar_ids = [calendar_ids]
+        # "all" may include calendars added since the channels were opened
+        if 'all' in calendar_ids:
+            return False
+        now_ms = time.time() * 1000
+        watched = {
+            channel['calendar_id'] for channel in self.channels.values()
+            if channel['expiration'] > now_ms
+        }
+        return set(calendar_ids) <= watched
+
+    def record(self, namespace: str, name: str, arguments: dict, result):
+        """Cache a read result, or invalidate after a write"""
+        if name in MUTATING_TOOLS:
+            self.cache.invalidate(namespace)
+            return
+        if name not in CACHEABLE_TOOLS or not self.watching(namespace):
+            return
+        # Results from calendars without a channel would never be invalidated
+        if namespace == 'calendar' and not self.watching_calendars(
+            (arguments or {}).get("calendar_ids") or (arguments or {}).get("calendar_id")
+        ):
+            return
+        if is_error(result):
+            return
+        resource_id = None
+        if name == "read_email":
+            resource_id = (arguments or {}).get("email_id")
+        elif name == "read_thread":
+            resource_id = (arguments or {}).get("thread_id")
+        elif name == "get_event":
+            resource_id = (arguments or {}).get("event_id")
+        self.cache.put(namespace, name, arguments, result, resource_id)
+
+    async def start(self):
+        """Start the receiver, open channels and schedule renewals"""
+        if self.gmail_topic and not self.secret:
+            # Pub/Sub pushes carry nothing else that proves where they came from
+            print("Gmail push disabled: set CALENDAR_MCP_PUSH_SECRET", file=sys.stderr)
+            self.gmail_topic = None
+        await self.receiver.start()
+        for calendar_id in self.calendar_ids:
+            await self.sync_calendar(calendar_id)
+            await asyncio.to_thread(self._watch_calendar, calendar_id)
+        if self.gmail_topic:
+            await asyncio.to_thread(self._watch_gmail)
+        self._renew_task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        """Stop renewing, close channels and the receiver"""
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+        for channel_id in list(self.channels):
+            await asyncio.to_thread(self._stop_channel, channel_id)
+        if self.gmail_topic and self.gmail_expiration is not None:
+            await asyncio.to_thread(lambda: get_gmail_service().users().stop(userId='me').execute())
+        await self.receiver.stop()
+
+    async def handle_notification(self, target: str, headers: dict, body: bytes):
+        """Route a POST from Calendar or Pub/Sub to the matching sync
+
+        Calendar notifications are checked against their channel's token
+        and Pub/Sub pushes against the shared secret in the URL. A Pub/Sub
+        push only triggers a sync; its contents are not trusted.
+        """
+        if 'x-goog-channel-id' in headers:
+            channel = self.channels.get(headers['x-goog-channel-id'])
+            if channel is None or headers.get('x-goog-channel-token') != channel['token']:
+                return
+            if headers.get('x-goog-resource-state') == 'sync':
+                return
+            await self.sync_calendar(channel['calendar_id'])
+            return
+
+        if not self.gmail_topic:
+            return
+        token = parse_qs(urlsplit(target).query).get('token', [''])[0]
+        if not secrets.compare_digest(token, self.secret):
+            raise PermissionError("Bad push token")
+        envelope = json.loads(body or b"{}")
+        if envelope.get('message', {}).get('data') is None:
+            return
+        await self.sync_gmail()
+
+    async def sync_calendar(self, calendar_id: str):
+        """Sync in a worker thread, then invalidate on the event loop
+
+        The cache and conflict indexes are only touched from the loop, so
+        tool calls never see them change mid-iteration.
+        """
+        if await asyncio.to_thread(self._sync_calendar, calendar_id):
+            self.cache.invalidate('calendar')
+            conflict_indexes.clear()
+
+    async def sync_gmail(self):
+        """Sync in a worker thread, then invalidate on the event loop"""
+        changed = await asyncio.to_thread(self._sync_gmail)
+        if changed is None:
+            self.cache.invalidate('gmail')
+        elif changed:
+            self.cache.invalidate('gmail', changed)
+
+    def _watch_calendar(self, calendar_id: str):
+        channel_id = str(uuid.uuid4())
+        token = secrets.token_urlsafe(16)
+        response = get_calendar_service().events().watch(
+            calendarId=calendar_id,
+            body={
+                'id': channel_id,
+                'type': 'web_hook',
+                'address': self.address,
+                'token': token,
+                'params': {'ttl': str(CHANNEL_TTL_SECONDS)}
+            }
+        ).execute()
+        self.channels[channel_id] = {
+            'calendar_id': calendar_id,
+            'resource_id': response['resourceId'],
+            'expiration': int(response['expiration']),
+            'token': token,
+        }
+
+    def _stop_channel(self, channel_id: str):
+        channel = self.channels.pop(channel_id)
+        try:
+            get_calendar_service().channels().stop(
+                body={'id': channel_id, 'resourceId': channel['resource_id']}
+            ).execute()
+        except HttpError:
+            # The channel may already have expired on Google's side
+            pass
+
+    def _watch_gmail(self):
+        response = get_gmail_service().users().watch(
+            userId='me',
+            body={'topicName': self.gmail_topic}
+        ).execute()
+        if self.gmail_history_id is None:
+            self.gmail_history_id = response['historyId']
+        self.gmail_expiration = int(response['expiration'])
+
+    def _sync_calendar(self, calendar_id: str) -> bool:
+        """Pull changes since the last sync token, returning whether any arrived"""
+        service = get_calendar_service()
+        token = self.sync_tokens.get(calendar_id)
+        changed = False
+        page_token = None
+        while True:
+            params = {
+                'calendarId': calendar_id,
+                'pageToken': page_token,
+                'maxResults': 2500,
+                'fields': 'items(id),nextPageToken,nextSyncToken',
+            }
+            if token:
+                params['syncToken'] = token
+            try:
+                result = service.events().list(**params).execute()
+            except HttpError as e:
+                if e.resp.status != 410 or not token:
+                    raise
+                # Sync token expired; start over with a full sync
+                token = None
+                changed = True
+                page_token = None
+                continue
+
+            if token and result.get('items'):
+                changed = True
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                self.sync_tokens[calendar_id] = result.get('nextSyncToken')
+                break
+
+        return changed
+
+    def _current_history_id(self, service) -> str:
+        return service.users().getProfile(userId='me', fields='historyId').execute()['historyId']
+
+    def _sync_gmail(self):
+        """IDs of messages and threads changed since the last history ID
+
+        Returns None when the changes cannot be told apart and every
+        cached Gmail read has to go.
+        """
+        service = get_gmail_service()
+        if self.gmail_history_id is None:
+            self.gmail_history_id = self._current_history_id(service)
+            return None
+
+        changed = set()
+        page_token = None
+        try:
+            while True:
+                result = service.users().history().list(
+                    userId='me',
+                    startHistoryId=self.gmail_history_id,
+                    pageToken=page_token
+                ).execute()
+                for record in result.get('history', []):
+                    for message in record.get('messages', []):
+                        changed.add(message['id'])
+                        changed.add(message.get('threadId'))
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    self.gmail_history_id = result.get('historyId', self.gmail_history_id)
+                    break
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # History ID too old to diff against; drop everything
+            self.gmail_history_id = self._current_history_id(service)
+            return None
+
+        return changed
+
+    async def _renew_loop(self):
+        """Replace channels shortly before Google expires them"""
+        while True:
+            await asyncio.sleep(RENEW_CHECK_SECONDS)
+            deadline_ms = (time.time() + RENEW_MARGIN_SECONDS) * 1000
+            try:
+                for channel_id, channel in list(self.channels.items()):
+                    if channel['expiration'] < deadline_ms:
+                        await asyncio.to_thread(self._watch_calendar, channel['calendar_id'])
+                        await asyncio.to_thread(self._stop_channel, channel_id)
+                if self.gmail_topic and (self.gmail_expiration or 0) < deadline_ms:
+                    await asyncio.to_thread(self._watch_gmail)
+            except Exception as e:
+                print(f"Failed to renew push channels: {e}", file=sys.stderr)
@@ -0,0 +1,142 @@
+"""Local expansion of recurring calendar events"""
+import heapq
+import itertools
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+from dateutil import rrule
+from .deadlines import execute_request
+from .times import get_zone, parse_iso, to_utc
+
+# Search has no natural end date, so local expansion stops this far ahead
+RECURRENCE_HORIZON_DAYS = 365
+
+def _parse_event_time(when: dict) -> tuple[datetime, bool]:
+    """Parse an event start/end dict into (datetime, all_day)"""
+    if 'dateTime' in when:
+        dt = parse_iso(when['dateTime'])
+        zone = get_zone(when['timeZone']) if when.get('timeZone') else None
+        if zone is not None:
+            # Recur in the series' own zone so DST shifts keep wall-clock time
+            dt = dt.replace(tzinfo=zone) if dt.tzinfo is None else dt.astimezone(zone)
+        return dt, False
+    return datetime.fromisoformat(when['date']), True
+
+def _format_event_time(dt: datetime, template: dict, all_day: bool) -> dict:
+    """Build an event start/end dict shaped like the master's"""
+    if all_day:
+        return {'date': dt.date().isoformat()}
+    when = {'dateTime': dt.isoformat()}
+    if template.get('timeZone'):
+        when['timeZone'] = template['timeZone']
+    return when
+
+def event_sort_key(event: dict) -> datetime:
+    """Sort key ordering timed and all-day events by their UTC start"""
+    start, _ = _parse_event_time(event['start'])
+    return to_utc(start)
+
+def event_bounds(event: dict) -> tuple[datetime, datetime]:
+    """UTC start and end of a timed or all-day event"""
+    start, _ = _parse_event_time(event['start'])
+    end, _ = _parse_event_time(event['end'])
+    return to_utc(start), to_utc(end)
+
+def _occurrence_key(dt: datetime, all_day: bool):
+    """Key matching an occurrence to its exception's originalStartTime"""
+    return dt.date() if all_day else to_utc(dt)
+
+def _expand_series(master: dict, overrides: dict, time_min: datetime,
+                   time_max: datetime) -> Iterator[dict]:
+    """Lazily yield the generated instances of one series inside the window"""
+    start, all_day = _parse_event_time(master['start'])
+    end, _ = _parse_event_time(master['end'])
+    duration = end - start
+
+    rules = rrule.rrulestr(
+        "\n".join(master['recurrence']),
+        dtstart=start,
+        forceset=True,
+        unfold=True
+    )
+
+    if all_day:
+        lo = time_min.astimezone(timezone.utc).replace(tzinfo=None)
+        hi = time_max.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        lo, hi = time_min, time_max
+
+    # Anything starting after lo - duration still overlaps the window
+    for occurrence in rules.xafter(lo - duration, inc=False):
+        if occurrence >= hi:
+            break
+        if _occurrence_key(occurrence, all_day) in overrides:
+            # Moved or cancelled instances are reported by the API separately
+            continue
+
+        instance = dict(master)
+        instance.pop('recurrence', None)
+        if all_day:
+            suffix = occurrence.strftime('%Y%m%d')
+        else:
+            suffix = to_utc(occurrence).strftime('%Y%m%dT%H%M%SZ')
+        instance['id'] = f"{master['id']}_{suffix}"
+        instance['recurringEventId'] = master['id']
+        instance['start'] = _format_event_time(occurrence, master['start'], all_day)
+        instance['end'] = _format_event_time(occurrence + duration, master['end'], all_day)
+        instance['originalStartTime'] = instance['start']
+        yield instance
+
+def list_expanded_events(service, time_min: datetime, time_max: datetime = None,
+                         max_results: int = None, query: str = None,
+                         calendar_id: str = 'primary') -> list[dict]:
+    """Fetch recurring masters plus exceptions once and expand them locally
+
+    Equivalent to events().list(singleEvents=True, orderBy='startTime') but
+    each series is transferred once instead of once per instance.
+    """
+    time_min = to_utc(time_min)
+    if time_max is None:
+        time_max = time_min + timedelta(days=RECURRENCE_HORIZON_DAYS)
+    time_max = to_utc(time_max)
+
+    masters = []
+    singles = []
+    overrides = {}
+    page_token = None
+    while True:
+        result = execute_request(service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            q=query,
+            singleEvents=False,
+            maxResults=2500,
+            pageToken=page_token
+        ))
+
+        for item in result.get('items', []):
+            if item.get('recurrence'):
+                masters.append(item)
+                continue
+            if item.get('recurringEventId'):
+                original, all_day = _parse_event_time(item['originalStartTime'])
+                overrides.setdefault(item['recurringEventId'], set()).add(
+                    _occurrence_key(original, all_day)
+                )
+            if item.get('status') != 'cancelled':
+                singles.append(item)
+
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+
+    singles.sort(key=event_sort_key)
+    streams = [singles] + [
+        _expand_series(master, overrides.get(master['id'], set()), time_min, time_max)
+        for master in masters
+        if master.get('status') != 'cancelled'
+    ]
+    merged = heapq.merge(*streams, key=event_sort_key)
+    if max_results:
+        return list(itertools.islice(merged, int(max_results)))
+    return list(merged)
@@ -0,0 +1,159 @@
+"""On-disk cache of events and messages for conditional re-reads
+
+Events are stored with their ETag. A re-read sends If-None-Match and gets
+a bodiless 304 when nothing changed, and updates send If-Match so a
+concurrent edit is refused instead of silently overwritten. Gmail messages
+have no ETag, but their content never changes, so a stored message is
+served without asking Gmail at all.
+"""
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from googleapiclient.errors import HttpError
+from .deadlines import execute
+
+RESOURCE_CACHE_PATH = Path(os.environ.get(
+    'CALENDAR_MCP_RESOURCE_CACHE', Path.home() / '.google-calendar-mcp' / 'resources.db'
+))
+# Entries kept per kind; 0 turns the cache off
+RESOURCE_CACHE_SIZE = int(os.environ.get('CALENDAR_MCP_RESOURCE_CACHE_SIZE', '500'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    etag TEXT,
+    body TEXT NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+"""
+
+class PreconditionFailed(Exception):
+    """The resource changed since the cached ETag was read"""
+
+class ResourceCache:
+    """Least recently used resources per kind, kept in SQLite across restarts"""
+
+    def __init__(self, path: Path = RESOURCE_CACHE_PATH, size: int = RESOURCE_CACHE_SIZE):
+        self.path = Path(path)
+        self.size = size
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(SCHEMA)
+            self._db.commit()
+        return self._db
+
+    def get(self, kind: str, key: str):
+        """(etag, resource) for a cached entry, or None"""
+        if self.size <= 0:
+            return None
+        row = self.db.execute(
+            "SELECT etag, body FROM resources WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute(
+                "UPDATE resources SET accessed = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+            )
+        return row[0], json.loads(row[1])
+
+    def put(self, kind: str, key: str, resource: dict, etag: str = None):
+        if self.size <= 0:
+            return
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO resources (kind, key, etag, body, accessed) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, etag, json.dumps(resource), time.time())
+            )
+            self.db.execute(
+                "DELETE FROM resources WHERE kind = ? AND key NOT IN "
+                "(SELECT key FROM resources WHERE kind = ? ORDER BY accessed DESC LIMIT ?)",
+                (kind, kind, self.size)
+            )
+
+    def discard(self, kind: str, key: str):
+        if self.size <= 0:
+            return
+        with self.db:
+            self.db.execute("DELETE FROM resources WHERE kind = ? AND key = ?", (kind, key))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+resources = ResourceCache()
+
+def _event_key(calendar_id: str, event_id: str) -> str:
+    return f"{calendar_id}/{event_id}"
+
+def remember_event(event: dict, calendar_id: str = 'primary'):
+    """Store an event returned by an insert or update"""
+    resources.put('event', _event_key(calendar_id, event['id']), event, event.get('etag'))
+
+def forget_event(event_id: str, calendar_id: str = 'primary'):
+    resources.discard('event', _event_key(calendar_id, event_id))
+
+async def get_event(service, event_id: str, calendar_id: str = 'primary') -> dict:
+    """Fetch an event, revalidating a cached copy with If-None-Match"""
+    key = _event_key(calendar_id, event_id)
+    cached = resources.get('event', key)
+    request = service.events().get(calendarId=calendar_id, eventId=event_id)
+    if cached and cached[0]:
+        request.headers['If-None-Match'] = cached[0]
+    try:
+        event = await execute(request)
+    except HttpError as e:
+        if e.resp.status == 304 and cached:
+            return cached[1]
+        if e.resp.status in (404, 410):
+            resources.discard('event', key)
+        raise
+    resources.put('event', key, event, event.get('etag'))
+    return event
+
+async def patch_event(service, event_id: str, changes: dict, calendar_id: str = 'primary',
+                      send_updates: str = 'none') -> dict:
+    """Patch an event, guarded by If-Match when its ETag is known
+
+    Raises PreconditionFailed if the event changed since it was cached.
+    """
+    key = _event_key(calendar_id, event_id)
+    cached = resources.get('event', key)
+    request = service.events().patch(
+        calendarId=calendar_id, eventId=event_id, body=changes, sendUpdates=send_updates
+    )
+    if cached and cached[0]:
+        request.headers['If-Match'] = cached[0]
+    try:
+        event = await execute(request)
+    except HttpError as e:
+        if e.resp.status == 412:
+            resources.discard('event', key)
+            raise PreconditionFailed(f"Event {event_id} was changed since it was last read") from e
+        raise
+    resources.put('event', key, event, event.get('etag'))
+    return event
+
+async def get_message(service, message_id: str, fields: str, hedge: bool = False) -> dict:
+    """Fetch a message, serving a stored copy since message content never changes"""
+    cached = resources.get('message', message_id)
+    if cached:
+        return cached[1]
+    message = await execute(service.users().messages().get(
+        userId='me', id=message_id, format='full', fields=fields
+    ), hedge=hedge)
+    resources.put('message', message_id, message)
+    return message
+
+def forget_message(message_id: str):
+    resources.discard('message', message_id)
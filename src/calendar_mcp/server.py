@@ -1,42 +1,53 @@
 """Google Calendar MCP Server"""
 import asyncio
-from datetime import datetime, timedelta
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 from typing import Any
 from mcp.server import Server
 from mcp.types import Tool, TextContent
 import mcp.server.stdio
 from .auth import get_calendar_service, get_gmail_service
+from .calendars import resolve_calendar_ids, fetch_from_calendars
+from .analytics import analyze_mailbox
+from .availability import find_common_slots
+from .conflicts import EventSpan, conflict_indexes, get_conflict_index
+from .deadlines import end_call, execute, execute_request, start_call, tool_deadline
+from .recurrence import event_bounds, list_expanded_events
+from .importer import import_ics
+from .mail import GMAIL_BATCH_MAX, extract_text, get_headers, strip_quoted
+from .times import format_datetime, get_user_timezone, get_zone, parse_datetime, parse_iso, to_utc
+from .outbox import outbox
+from .output import CHARS_PER_TOKEN, add_output_options, finalize, render, render_one
+from .prefetch import MESSAGE_FIELDS, prefetcher
+from .push import PushManager, PUSH_ADDRESS, GMAIL_TOPIC
+from .trace import TRACE_PATH, record_call
+from .resources import (
+    PreconditionFailed, forget_event, forget_message, get_event, get_message,
+    patch_event, remember_event, resources
+)
 import base64
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
+from email.utils import make_msgid
 import os
+import sys
 
 app = Server("google-calendar-mcp")
 
-def format_datetime(dt_str: str) -> str:
-    """Format ISO datetime to readable string"""
-    try:
-        dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-        return dt.strftime('%a, %b %d at %I:%M %p')
-    except:
-        return dt_str
-
 def parse_datetime_input(date_str: str, time_str: str = None) -> str:
     """Parse user input into ISO datetime"""
-    # Simple parsing - can be enhanced
-    from dateutil import parser
     if time_str:
-        dt = parser.parse(f"{date_str} {time_str}")
+        dt = parse_datetime(f"{date_str} {time_str}")
     else:
-        dt = parser.parse(date_str)
+        dt = parse_datetime(date_str)
     return dt.isoformat()
 
 @app.list_tools()
 async def list_tools() -> list[Tool]:
     """List available calendar tools"""
-    return [
+    return add_output_options([
         Tool(
             name="list_events",
             description="List calendar events for a time range",
@@ -60,6 +71,16 @@ async def list_tools() -> list[Tool]:
                     "end_date": {
                         "type": "string",
                         "description": "End date for custom range (ISO format or natural language)"
+                    },
+                    "calendar_ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Calendar IDs to query, or [\"all\"] for every calendar in your list (default: primary)"
+                    },
+                    "expand_recurring_locally": {
+                        "type": "boolean",
+                        "description": "Fetch each recurring series once and expand its instances locally instead of server-side (faster for long ranges, default: false)",
+                        "default": False
                     }
                 },
                 "required": ["time_range"]
@@ -100,6 +121,16 @@ async def list_tools() -> list[Tool]:
                         "type": "boolean",
                         "description": "Whether to send email invitations to attendees (default: false)",
                         "default": False
+                    },
+                    "check_conflicts": {
+                        "type": "boolean",
+                        "description": "Report existing events that overlap the new one (default: true)",
+                        "default": True
+                    },
+                    "refuse_on_conflict": {
+                        "type": "boolean",
+                        "description": "Do not create the event if it overlaps another one (default: false)",
+                        "default": False
                     }
                 },
                 "required": ["summary", "start_time", "end_time"]
@@ -124,6 +155,96 @@ async def list_tools() -> list[Tool]:
                 "required": ["event_id"]
             }
         ),
+        Tool(
+            name="get_event",
+            description="Show the details of a calendar event",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "event_id": {
+                        "type": "string",
+                        "description": "Event ID"
+                    },
+                    "calendar_id": {
+                        "type": "string",
+                        "description": "Calendar ID (default: primary)",
+                        "default": "primary"
+                    }
+                },
+                "required": ["event_id"]
+            }
+        ),
+        Tool(
+            name="update_event",
+            description="Change the title, time, description or location of an event. Read it with get_event first so edits made elsewhere since are refused instead of overwritten",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "event_id": {
+                        "type": "string",
+                        "description": "Event ID to update"
+                    },
+                    "calendar_id": {
+                        "type": "string",
+                        "description": "Calendar ID (default: primary)",
+                        "default": "primary"
+                    },
+                    "summary": {
+                        "type": "string",
+                        "description": "New title (optional)"
+                    },
+                    "start_time": {
+                        "type": "string",
+                        "description": "New start time (optional, ISO format or natural language)"
+                    },
+                    "end_time": {
+                        "type": "string",
+                        "description": "New end time (optional, ISO format or natural language)"
+                    },
+                    "description": {
+                        "type": "string",
+                        "description": "New description (optional)"
+                    },
+                    "location": {
+                        "type": "string",
+                        "description": "New location (optional)"
+                    },
+                    "send_invites": {
+                        "type": "boolean",
+                        "description": "Whether to email attendees about the change (default: false)",
+                        "default": False
+                    }
+                },
+                "required": ["event_id"]
+            }
+        ),
+        Tool(
+            name="check_conflicts",
+            description="Check proposed time slots against existing events",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "slots": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "start_time": {"type": "string"},
+                                "end_time": {"type": "string"}
+                            },
+                            "required": ["start_time", "end_time"]
+                        },
+                        "description": "Proposed slots, each with start_time and end_time (ISO format or natural language)"
+                    },
+                    "calendar_ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Calendar IDs to check against, or [\"all\"] for every calendar in your list (default: primary)"
+                    }
+                },
+                "required": ["slots"]
+            }
+        ),
         Tool(
             name="find_free_slots",
             description="Find available time slots in calendar",
@@ -144,10 +265,74 @@ async def list_tools() -> list[Tool]:
                         "type": "boolean",
                         "description": "Only show slots during work hours 9 AM - 5 PM (default: true)",
                         "default": True
+                    },
+                    "calendar_ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Calendar IDs to query, or [\"all\"] for every calendar in your list (default: primary)"
+                    },
+                    "expand_recurring_locally": {
+                        "type": "boolean",
+                        "description": "Fetch each recurring series once and expand its instances locally instead of server-side (faster for long ranges, default: false)",
+                        "default": False
                     }
                 }
             }
         ),
+        Tool(
+            name="find_common_slots",
+            description="Find meeting times that work for a group of attendees",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "attendees": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Attendee or Google Group email addresses"
+                    },
+                    "duration_minutes": {
+                        "type": "number",
+                        "description": "Meeting length in minutes (default: 60)",
+                        "default": 60
+                    },
+                    "days_ahead": {
+                        "type": "number",
+                        "description": "How many days ahead to search (default: 7)",
+                        "default": 7
+                    },
+                    "timezone": {
+                        "type": "string",
+                        "description": "Timezone for results and for attendees without their own (default: your calendar's timezone)"
+                    },
+                    "attendee_timezones": {
+                        "type": "object",
+                        "additionalProperties": {"type": "string"},
+                        "description": "Map of attendee email to IANA timezone, e.g. {\"a@example.com\": \"Europe/Berlin\"} (optional)"
+                    },
+                    "work_hours_start": {
+                        "type": "number",
+                        "description": "Start of each attendee's work day, local hour (default: 9)",
+                        "default": 9
+                    },
+                    "work_hours_end": {
+                        "type": "number",
+                        "description": "End of each attendee's work day, local hour (default: 17)",
+                        "default": 17
+                    },
+                    "include_me": {
+                        "type": "boolean",
+                        "description": "Also consider your own primary calendar (default: true)",
+                        "default": True
+                    },
+                    "max_results": {
+                        "type": "number",
+                        "description": "Maximum slots to return (default: 10)",
+                        "default": 10
+                    }
+                },
+                "required": ["attendees"]
+            }
+        ),
         Tool(
             name="search_events",
             description="Search for events by keyword",
@@ -162,11 +347,40 @@ async def list_tools() -> list[Tool]:
                         "type": "number",
                         "description": "Maximum results to return (default: 10)",
                         "default": 10
+                    },
+                    "calendar_ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Calendar IDs to query, or [\"all\"] for every calendar in your list (default: primary)"
+                    },
+                    "expand_recurring_locally": {
+                        "type": "boolean",
+                        "description": "Fetch each recurring series once and expand its instances locally instead of server-side (faster for long ranges, default: false)",
+                        "default": False
                     }
                 },
                 "required": ["query"]
             }
         ),
+        Tool(
+            name="import_ics",
+            description="Import events from an .ics file (safe to re-run)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "path": {
+                        "type": "string",
+                        "description": "Path to the .ics file"
+                    },
+                    "calendar_id": {
+                        "type": "string",
+                        "description": "Calendar to import into (default: primary)",
+                        "default": "primary"
+                    }
+                },
+                "required": ["path"]
+            }
+        ),
         Tool(
             name="send_email",
             description="Send an email via Gmail",
@@ -197,6 +411,15 @@ async def list_tools() -> list[Tool]:
                     "bcc": {
                         "type": "string",
                         "description": "BCC email addresses (comma-separated, optional)"
+                    },
+                    "queue": {
+                        "type": "boolean",
+                        "description": "Queue for background sending and return a queue ID immediately (default: false)",
+                        "default": False
+                    },
+                    "idempotency_key": {
+                        "type": "string",
+                        "description": "Key that stops a retried call from queueing the same message twice (with queue)"
                     }
                 },
                 "required": ["to", "subject", "body"]
@@ -259,6 +482,72 @@ async def list_tools() -> list[Tool]:
                 "required": ["email_id"]
             }
         ),
+        Tool(
+            name="list_threads",
+            description="List email conversations (threads)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Search query (default: 'in:inbox')",
+                        "default": "in:inbox"
+                    },
+                    "max_results": {
+                        "type": "number",
+                        "description": "Maximum threads to return (default: 10)",
+                        "default": 10
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="read_thread",
+            description="Read a whole email conversation in one call",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "thread_id": {
+                        "type": "string",
+                        "description": "Thread ID"
+                    },
+                    "offset": {
+                        "type": "number",
+                        "description": "Index of the first message to show, for long threads (default: 0)",
+                        "default": 0
+                    },
+                    "max_messages": {
+                        "type": "number",
+                        "description": "Maximum messages to show (default: 10)",
+                        "default": 10
+                    }
+                },
+                "required": ["thread_id"]
+            }
+        ),
+        Tool(
+            name="analyze_mailbox",
+            description="Summarize top senders, domains, labels and volume over time for all emails matching a query",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Gmail search query (default: all mail)"
+                    },
+                    "max_messages": {
+                        "type": "number",
+                        "description": "Most messages to scan (default: 10000)",
+                        "default": 10000
+                    },
+                    "top": {
+                        "type": "number",
+                        "description": "Entries to show per ranking (default: 10)",
+                        "default": 10
+                    }
+                }
+            }
+        ),
         Tool(
             name="mark_email",
             description="Mark email as read/unread",
@@ -310,6 +599,15 @@ async def list_tools() -> list[Tool]:
                     "body": {
                         "type": "string",
                         "description": "Reply message body"
+                    },
+                    "queue": {
+                        "type": "boolean",
+                        "description": "Queue for background sending and return a queue ID immediately (default: false)",
+                        "default": False
+                    },
+                    "idempotency_key": {
+                        "type": "string",
+                        "description": "Key that stops a retried call from queueing the same message twice (with queue)"
                     }
                 },
                 "required": ["email_id", "body"]
@@ -332,6 +630,15 @@ async def list_tools() -> list[Tool]:
                     "body": {
                         "type": "string",
                         "description": "Email body"
+                    },
+                    "queue": {
+                        "type": "boolean",
+                        "description": "Queue for background creation and return a queue ID immediately (default: false)",
+                        "default": False
+                    },
+                    "idempotency_key": {
+                        "type": "string",
+                        "description": "Key that stops a retried call from queueing the same message twice (with queue)"
                     }
                 },
                 "required": ["to", "subject", "body"]
@@ -362,19 +669,64 @@ async def list_tools() -> list[Tool]:
                 },
                 "required": ["email_id", "label"]
             }
+        ),
+        Tool(
+            name="outbox_status",
+            description="Show the status of queued emails and drafts",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "queue_id": {
+                        "type": "number",
+                        "description": "Queue ID returned when queueing (optional; shows recent entries if omitted)"
+                    }
+                }
+            }
         )
-    ]
+    ])
+
+# Gmail tools
+GMAIL_TOOLS = ["send_email", "list_emails", "search_emails", "read_email",
+               "mark_email", "delete_email", "reply_to_email", "create_draft",
+               "list_labels", "add_label", "list_threads", "read_thread", "outbox_status",
+               "analyze_mailbox"]
+
+# Set by main() when push notifications are configured
+push_manager = None
 
 @app.call_tool()
 async def call_tool(name: str, arguments: Any) -> list[TextContent]:
     """Handle tool calls"""
+    if TRACE_PATH:
+        record_call(name, arguments)
+    namespace = "gmail" if name in GMAIL_TOOLS else "calendar"
+    if push_manager is not None:
+        cached = push_manager.cache.get(namespace, name, arguments)
+        if cached is not None:
+            return cached
+    
+    state, token = start_call(name)
     try:
-        # Gmail tools
-        gmail_tools = ["send_email", "list_emails", "search_emails", "read_email", 
-                       "mark_email", "delete_email", "reply_to_email", "create_draft",
-                       "list_labels", "add_label"]
-        
-        if name in gmail_tools:
+        result = await asyncio.wait_for(dispatch_tool(name, arguments), tool_deadline(name))
+    except asyncio.TimeoutError:
+        # Requests still in flight in worker threads stop at their next API call
+        state.cancelled.set()
+        return finalize(arguments, [TextContent(type="text", text=f"❌ {name} timed out after {tool_deadline(name):g}s")])
+    except asyncio.CancelledError:
+        state.cancelled.set()
+        raise
+    finally:
+        end_call(token)
+    
+    result = finalize(arguments, result)
+    if push_manager is not None:
+        push_manager.record(namespace, name, arguments, result)
+    return result
+
+async def dispatch_tool(name: str, arguments: Any) -> list[TextContent]:
+    """Route a tool call to its handler"""
+    try:
+        if name in GMAIL_TOOLS:
             gmail_service = get_gmail_service()
             
             if name == "send_email":
@@ -397,6 +749,14 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                 return await handle_list_labels(gmail_service, arguments)
             elif name == "add_label":
                 return await handle_add_label(gmail_service, arguments)
+            elif name == "list_threads":
+                return await handle_list_threads(gmail_service, arguments)
+            elif name == "read_thread":
+                return await handle_read_thread(gmail_service, arguments)
+            elif name == "outbox_status":
+                return await handle_outbox_status(gmail_service, arguments)
+            elif name == "analyze_mailbox":
+                return await handle_analyze_mailbox(gmail_service, arguments)
         else:
             # Calendar tools
             service = get_calendar_service()
@@ -407,10 +767,20 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                 return await handle_create_event(service, arguments)
             elif name == "delete_event":
                 return await handle_delete_event(service, arguments)
+            elif name == "get_event":
+                return await handle_get_event(service, arguments)
+            elif name == "update_event":
+                return await handle_update_event(service, arguments)
             elif name == "find_free_slots":
                 return await handle_find_free_slots(service, arguments)
             elif name == "search_events":
                 return await handle_search_events(service, arguments)
+            elif name == "check_conflicts":
+                return await handle_check_conflicts(service, arguments)
+            elif name == "import_ics":
+                return await handle_import_ics(service, arguments)
+            elif name == "find_common_slots":
+                return await handle_find_common_slots(service, arguments)
             else:
                 return [TextContent(type="text", text=f"Unknown tool: {name}")]
     
@@ -422,9 +792,10 @@ async def handle_list_events(service, args):
     time_range = args.get("time_range", "today")
     max_results = args.get("max_results", 10)
     
-    now = datetime.utcnow()
+    tz_name = await get_user_timezone(service)
+    now = datetime.now(get_zone(tz_name))
     
-    # Calculate time range
+    # Calculate time range in the user's own timezone
     if time_range == "today":
         start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         end = start + timedelta(days=1)
@@ -438,58 +809,77 @@ async def handle_list_events(service, args):
         start = (now + timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
         end = start + timedelta(days=7)
     else:  # custom
-        from dateutil import parser
-        start = parser.parse(args.get("start_date", now.isoformat()))
-        end = parser.parse(args.get("end_date", (now + timedelta(days=7)).isoformat()))
+        start = parse_datetime(args["start_date"], tz_name) if "start_date" in args else now
+        end = parse_datetime(args["end_date"], tz_name) if "end_date" in args else now + timedelta(days=7)
     
     # Fetch events
-    events_result = service.events().list(
-        calendarId='primary',
-        timeMin=start.isoformat() + 'Z',
-        timeMax=end.isoformat() + 'Z',
-        maxResults=max_results,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    
-    events = events_result.get('items', [])
-    
-    if not events:
-        return [TextContent(type="text", text=f"No events found for {time_range}")]
-    
-    # Format output
-    output = f"📅 Events for {time_range}:\n\n"
-    for event in events:
-        start_time = event['start'].get('dateTime', event['start'].get('date'))
-        summary = event.get('summary', 'No title')
-        location = event.get('location', '')
-        event_id = event['id']
-        
-        output += f"• {format_datetime(start_time)}\n"
-        output += f"  {summary}\n"
-        if location:
-            output += f"  📍 {location}\n"
-        output += f"  ID: {event_id}\n\n"
+    calendar_ids = await resolve_calendar_ids(service, args.get("calendar_ids"))
+    
+    def fetch(calendar_service, calendar_id):
+        if args.get("expand_recurring_locally", False):
+            return list_expanded_events(
+                calendar_service, start, end, max_results=max_results, calendar_id=calendar_id
+            )
+        events_result = execute_request(calendar_service.events().list(
+            calendarId=calendar_id,
+            timeMin=start.isoformat(),
+            timeMax=end.isoformat(),
+            maxResults=max_results,
+            singleEvents=True,
+            orderBy='startTime'
+        ), hedge=True)
+        return events_result.get('items', [])
+    
+    events = await fetch_from_calendars(service, calendar_ids, fetch, max_results)
     
-    return [TextContent(type="text", text=output)]
+    return render(
+        args,
+        [event_record(event) for event in events],
+        lambda event: format_event_line(event, len(calendar_ids) > 1),
+        header=f"📅 Events for {time_range}:\n\n",
+        empty=f"No events found for {time_range}",
+        time_range=time_range
+    )
+
+def event_record(event: dict) -> dict:
+    """Stable fields of an event for structured output"""
+    record = {
+        'id': event['id'],
+        'summary': event.get('summary', 'No title'),
+        'start': event['start'].get('dateTime', event['start'].get('date')),
+        'end': event.get('end', {}).get('dateTime', event.get('end', {}).get('date')),
+    }
+    if event.get('location'):
+        record['location'] = event['location']
+    if event.get('calendarId'):
+        record['calendar_id'] = event['calendarId']
+    return record
+
+def format_event_line(record: dict, show_calendar: bool = False) -> str:
+    """One event of a listing as text"""
+    text = f"• {format_datetime(record['start'])}\n  {record['summary']}\n"
+    if record.get('location'):
+        text += f"  📍 {record['location']}\n"
+    if show_calendar:
+        text += f"  🗓️ {record['calendar_id']}\n"
+    return text + f"  ID: {record['id']}\n\n"
 
 async def handle_create_event(service, args):
     """Create a new calendar event"""
-    from dateutil import parser
-    
+    tz_name = await get_user_timezone(service)
     summary = args["summary"]
-    start_time = parser.parse(args["start_time"])
-    end_time = parser.parse(args["end_time"])
+    start_time = parse_datetime(args["start_time"], tz_name)
+    end_time = parse_datetime(args["end_time"], tz_name)
     
     event = {
         'summary': summary,
         'start': {
             'dateTime': start_time.isoformat(),
-            'timeZone': 'UTC',
+            'timeZone': tz_name,
         },
         'end': {
             'dateTime': end_time.isoformat(),
-            'timeZone': 'UTC',
+            'timeZone': tz_name,
         },
     }
     
@@ -500,25 +890,183 @@ async def handle_create_event(service, args):
     if 'attendees' in args:
         event['attendees'] = [{'email': email} for email in args['attendees']]
     
+    conflicts = []
+    if args.get('check_conflicts', True) or args.get('refuse_on_conflict', False):
+        index = await get_conflict_index(service, ['primary'], start_time, end_time)
+        conflicts = index.overlapping(to_utc(start_time).timestamp(), to_utc(end_time).timestamp())
+    
+    if conflicts and args.get('refuse_on_conflict', False):
+        return render_one(
+            args,
+            f"❌ Event not created: {summary} overlaps {len(conflicts)} event(s)\n\n" + format_conflicts(conflicts, tz_name),
+            created=False,
+            conflicts=[conflict_record(span) for span in conflicts]
+        )
+    
     # Only send email invites if explicitly requested
     send_updates = 'all' if args.get('send_invites', False) else 'none'
-    created_event = service.events().insert(calendarId='primary', body=event, sendUpdates=send_updates).execute()
+    created_event = await execute(service.events().insert(calendarId='primary', body=event, sendUpdates=send_updates))
+    conflict_indexes.add(EventSpan.from_event(created_event))
+    remember_event(created_event)
     
-    output = f"✅ Event created successfully!\n\n"
-    output += f"📅 {summary}\n"
-    output += f"🕐 {format_datetime(start_time.isoformat())}\n"
-    output += f"ID: {created_event['id']}\n"
-    output += f"Link: {created_event.get('htmlLink', 'N/A')}"
+    output = [
+        "✅ Event created successfully!\n\n",
+        f"📅 {summary}\n",
+        f"🕐 {format_datetime(start_time)}\n",
+        f"ID: {created_event['id']}\n",
+        f"Link: {created_event.get('htmlLink', 'N/A')}",
+    ]
+    if conflicts:
+        output.append(f"\n\n⚠️ Overlaps {len(conflicts)} existing event(s):\n")
+        output.append(format_conflicts(conflicts, tz_name))
     
-    return [TextContent(type="text", text=output)]
+    return render_one(
+        args,
+        "".join(output),
+        created=True,
+        **event_record(created_event),
+        link=created_event.get('htmlLink'),
+        conflicts=[conflict_record(span) for span in conflicts]
+    )
+
+async def handle_get_event(service, args):
+    """Show one event, revalidating the cached copy"""
+    event_id = args["event_id"]
+    calendar_id = args.get("calendar_id", "primary")
+    
+    try:
+        event = await get_event(service, event_id, calendar_id)
+        start_time = event['start'].get('dateTime', event['start'].get('date'))
+        end_time = event['end'].get('dateTime', event['end'].get('date'))
+        
+        attendees = [a['email'] for a in event.get('attendees', [])]
+        
+        output = [
+            f"📅 {event.get('summary', 'No title')}\n",
+            f"🕐 {format_datetime(start_time)} - {format_datetime(end_time)}\n",
+        ]
+        if event.get('location'):
+            output.append(f"📍 {event['location']}\n")
+        if attendees:
+            output.append(f"👥 {', '.join(attendees)}\n")
+        if event.get('description'):
+            output.append(f"\n{event['description']}\n")
+        output.append(f"\nID: {event['id']}\n")
+        output.append(f"Link: {event.get('htmlLink', 'N/A')}")
+        
+        return render_one(
+            args,
+            "".join(output),
+            **event_record(event),
+            description=event.get('description'),
+            attendees=attendees,
+            link=event.get('htmlLink')
+        )
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to get event: {str(e)}")]
+
+async def handle_update_event(service, args):
+    """Patch an event without overwriting changes made elsewhere"""
+    event_id = args["event_id"]
+    calendar_id = args.get("calendar_id", "primary")
+    tz_name = await get_user_timezone(service)
+    
+    changes = {}
+    for field in ('summary', 'description', 'location'):
+        if field in args:
+            changes[field] = args[field]
+    if 'start_time' in args:
+        changes['start'] = {'dateTime': parse_datetime(args['start_time'], tz_name).isoformat(), 'timeZone': tz_name}
+    if 'end_time' in args:
+        changes['end'] = {'dateTime': parse_datetime(args['end_time'], tz_name).isoformat(), 'timeZone': tz_name}
+    if not changes:
+        return [TextContent(type="text", text="❌ Nothing to update")]
+    
+    send_updates = 'all' if args.get('send_invites', False) else 'none'
+    try:
+        event = await patch_event(service, event_id, changes, calendar_id, send_updates)
+    except PreconditionFailed as e:
+        return [TextContent(type="text", text=f"❌ {e}. Use get_event to see the current version, then update again.")]
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to update event: {str(e)}")]
+    
+    conflict_indexes.discard(event_id)
+    if event.get('status') != 'cancelled' and event.get('transparency') != 'transparent':
+        conflict_indexes.add(EventSpan.from_event(event, calendar_id))
+    
+    record = event_record(event)
+    return render_one(
+        args,
+        f"✅ Event updated successfully!\n\n📅 {record['summary']}\n🕐 {format_datetime(record['start'])}\nID: {record['id']}",
+        updated=True,
+        **record
+    )
+
+def conflict_record(span: EventSpan) -> dict:
+    return {
+        'id': span.event_id,
+        'summary': span.summary,
+        'start': datetime.fromtimestamp(span.start, timezone.utc).isoformat(),
+        'end': datetime.fromtimestamp(span.end, timezone.utc).isoformat(),
+        'calendar_id': span.calendar_id,
+    }
+
+def format_conflicts(conflicts, zone: str = None) -> str:
+    """Format overlapping event spans as a bullet list"""
+    lines = []
+    for span in conflicts:
+        start = datetime.fromtimestamp(span.start, timezone.utc)
+        lines.append(f"  • {format_datetime(start, zone)} - {span.summary} (ID: {span.event_id})\n")
+    return "".join(lines)
+
+async def handle_check_conflicts(service, args):
+    """Check many proposed slots against one conflict index"""
+    tz_name = await get_user_timezone(service)
+    slots = [
+        (to_utc(parse_datetime(slot["start_time"], tz_name)), to_utc(parse_datetime(slot["end_time"], tz_name)))
+        for slot in args["slots"]
+    ]
+    if not slots:
+        return [TextContent(type="text", text="No slots to check")]
+    
+    calendar_ids = await resolve_calendar_ids(service, args.get("calendar_ids"))
+    index = await get_conflict_index(
+        service,
+        calendar_ids,
+        min(start for start, _ in slots),
+        max(end for _, end in slots)
+    )
+    
+    records = []
+    for start, end in slots:
+        conflicts = index.overlapping(start.timestamp(), end.timestamp())
+        records.append({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'free': not conflicts,
+            'conflicts': [conflict_record(span) for span in conflicts],
+        })
+    
+    def line(record):
+        text = f"• {format_datetime(parse_iso(record['start']), tz_name)} - {format_datetime(parse_iso(record['end']), tz_name)}\n"
+        if record['free']:
+            return text + "  ✅ Free\n\n"
+        return text + f"  ⚠️ {len(record['conflicts'])} conflict(s):\n" + "".join(
+            f"  • {format_datetime(parse_iso(c['start']), tz_name)} - {c['summary']} (ID: {c['id']})\n"
+            for c in record['conflicts']
+        ) + "\n"
+    
+    return render(args, records, line, header=f"🔎 Conflict check for {len(slots)} slot(s):\n\n")
 
 async def handle_delete_event(service, args):
     """Delete a calendar event"""
     event_id = args["event_id"]
     
     try:
-        service.events().delete(calendarId='primary', eventId=event_id).execute()
-        return [TextContent(type="text", text=f"✅ Event {event_id} deleted successfully")]
+        await execute(service.events().delete(calendarId='primary', eventId=event_id))
+        conflict_indexes.discard(event_id)
+        forget_event(event_id)
+        return render_one(args, f"✅ Event {event_id} deleted successfully", deleted=True, id=event_id)
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to delete event: {str(e)}")]
 
@@ -528,77 +1076,201 @@ async def handle_find_free_slots(service, args):
     days_ahead = args.get("days_ahead", 7)
     work_hours_only = args.get("work_hours_only", True)
     
-    now = datetime.utcnow()
+    tz_name = await get_user_timezone(service)
+    now = datetime.now(timezone.utc)
     end_date = now + timedelta(days=days_ahead)
     
     # Fetch all events in range
-    events_result = service.events().list(
-        calendarId='primary',
-        timeMin=now.isoformat() + 'Z',
-        timeMax=end_date.isoformat() + 'Z',
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
+    calendar_ids = await resolve_calendar_ids(service, args.get("calendar_ids"))
+    
+    def fetch(calendar_service, calendar_id):
+        if args.get("expand_recurring_locally", False):
+            return list_expanded_events(calendar_service, now, end_date, calendar_id=calendar_id)
+        events_result = execute_request(calendar_service.events().list(
+            calendarId=calendar_id,
+            timeMin=now.isoformat(),
+            timeMax=end_date.isoformat(),
+            singleEvents=True,
+            orderBy='startTime'
+        ))
+        return events_result.get('items', [])
     
-    events = events_result.get('items', [])
+    events = await fetch_from_calendars(service, calendar_ids, fetch)
     
     # Find gaps between events
     free_slots = []
     current_time = now
     
     for event in events:
-        event_start = datetime.fromisoformat(event['start'].get('dateTime', event['start'].get('date')).replace('Z', '+00:00'))
+        event_start, event_end = event_bounds(event)
         
         # Check if there's a gap
         gap_minutes = (event_start - current_time).total_seconds() / 60
         if gap_minutes >= duration:
-            if not work_hours_only or (9 <= current_time.hour < 17):
+            if not work_hours_only or (9 <= current_time.astimezone(get_zone(tz_name)).hour < 17):
                 free_slots.append({
-                    'start': current_time,
-                    'end': event_start,
-                    'duration': gap_minutes
+                    'start': current_time.isoformat(),
+                    'end': event_start.isoformat(),
+                    'minutes': int(gap_minutes)
                 })
         
-        event_end = datetime.fromisoformat(event['end'].get('dateTime', event['end'].get('date')).replace('Z', '+00:00'))
         current_time = max(current_time, event_end)
     
-    # Format output
-    if not free_slots:
-        return [TextContent(type="text", text=f"No free slots found for {duration} minutes in the next {days_ahead} days")]
+    return render(
+        args,
+        free_slots[:10],  # Limit to 10 slots
+        lambda slot: f"• {format_datetime(parse_iso(slot['start']), tz_name)}\n  Duration: {slot['minutes']} minutes\n\n",
+        header=f"🕐 Available {duration}-minute slots:\n\n",
+        empty=f"No free slots found for {duration} minutes in the next {days_ahead} days",
+        duration_minutes=duration
+    )
+
+async def handle_find_common_slots(service, args):
+    """Find slots that suit a group of attendees"""
+    attendees = list(dict.fromkeys(args["attendees"]))
+    duration = int(args.get("duration_minutes", 60))
+    days_ahead = args.get("days_ahead", 7)
+    tz_name = args.get("timezone") or await get_user_timezone(service)
+    max_results = int(args.get("max_results", 10))
+    
+    if args.get("include_me", True) and "primary" not in attendees:
+        attendees.append("primary")
+    
+    # Start at the next half hour so the first slot is not in the past
+    step = timedelta(minutes=30)
+    now = datetime.now(timezone.utc)
+    start = now + timedelta(seconds=-now.timestamp() % step.total_seconds())
+    end = start + timedelta(days=days_ahead)
     
-    output = f"🕐 Available {duration}-minute slots:\n\n"
-    for slot in free_slots[:10]:  # Limit to 10 slots
-        output += f"• {format_datetime(slot['start'].isoformat())}\n"
-        output += f"  Duration: {int(slot['duration'])} minutes\n\n"
+    slots, attendee_count, errors = await find_common_slots(
+        attendees,
+        start,
+        end,
+        duration=timedelta(minutes=duration),
+        step=step,
+        work_start=int(args.get("work_hours_start", 9)),
+        work_end=int(args.get("work_hours_end", 17)),
+        default_timezone=tz_name,
+        attendee_timezones=args.get("attendee_timezones"),
+        max_results=max_results
+    )
     
-    return [TextContent(type="text", text=output)]
+    def line(record):
+        text = f"• {format_datetime(parse_iso(record['start']), tz_name)}\n"
+        if record['busy']:
+            return text + f"  ⚠️ {len(record['busy'])} busy: {', '.join(record['busy'])}\n\n"
+        return text + "  ✅ Everyone available\n\n"
+    
+    footer = ""
+    if errors:
+        footer = "❓ Availability unknown for:\n" + "".join(
+            f"  {calendar_id} ({reason})\n" for calendar_id, reason in errors.items()
+        )
+    
+    return render(
+        args,
+        [{'start': slot.isoformat(), 'end': (slot + timedelta(minutes=duration)).isoformat(), 'busy': conflicts}
+         for slot, conflicts in slots],
+        line,
+        header=f"🤝 Best {duration}-minute slots for {attendee_count} attendees ({tz_name}):\n\n",
+        footer=footer,
+        empty=f"No {duration}-minute slots within shared work hours in the next {days_ahead} days",
+        attendees=attendee_count,
+        timezone=tz_name,
+        unknown=errors
+    )
+
+def progress_reporter():
+    """Thread-safe callback sending MCP progress notifications, if the client asked for them"""
+    try:
+        ctx = app.request_context
+    except LookupError:
+        return None
+    token = ctx.meta.progressToken if ctx.meta else None
+    if token is None:
+        return None
+    loop = asyncio.get_running_loop()
+    
+    def report(done: int):
+        asyncio.run_coroutine_threadsafe(ctx.session.send_progress_notification(token, done), loop)
+    return report
+
+async def handle_import_ics(service, args):
+    """Import an .ics file with batched events.import calls"""
+    path = os.path.expanduser(args["path"])
+    calendar_id = args.get("calendar_id", "primary")
+    
+    if not os.path.isfile(path):
+        return [TextContent(type="text", text=f"❌ File not found: {path}")]
+    
+    report = progress_reporter()
+    progress = None
+    if report:
+        progress = lambda imported, skipped, failed: report(imported + skipped + failed)
+    
+    try:
+        summary = await asyncio.to_thread(
+            import_ics,
+            service,
+            path,
+            calendar_id,
+            await get_user_timezone(service),
+            progress=progress
+        )
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to import events: {str(e)}")]
+    
+    conflict_indexes.clear()
+    
+    output = [
+        f"✅ Import finished for {os.path.basename(path)}\n\n",
+        f"📥 Imported: {summary['imported']}\n",
+        f"⏭️ Already present: {summary['skipped']}\n",
+        f"❌ Failed: {summary['failed']}\n",
+    ]
+    output.extend(f"  {error}\n" for error in summary['errors'])
+    
+    return render_one(args, "".join(output), **summary)
 
 async def handle_search_events(service, args):
     """Search for events"""
     query = args["query"]
     max_results = args.get("max_results", 10)
     
-    events_result = service.events().list(
-        calendarId='primary',
-        q=query,
-        maxResults=max_results,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
+    calendar_ids = await resolve_calendar_ids(service, args.get("calendar_ids"))
     
-    events = events_result.get('items', [])
+    def fetch(calendar_service, calendar_id):
+        if args.get("expand_recurring_locally", False):
+            # Expansion needs a bounded window, so search from now onwards
+            return list_expanded_events(
+                calendar_service, datetime.now(timezone.utc), max_results=max_results,
+                query=query, calendar_id=calendar_id
+            )
+        events_result = execute_request(calendar_service.events().list(
+            calendarId=calendar_id,
+            q=query,
+            maxResults=max_results,
+            singleEvents=True,
+            orderBy='startTime'
+        ))
+        return events_result.get('items', [])
     
-    if not events:
-        return [TextContent(type="text", text=f"No events found matching '{query}'")]
+    events = await fetch_from_calendars(service, calendar_ids, fetch, max_results)
     
-    output = f"🔍 Search results for '{query}':\n\n"
-    for event in events:
-        start_time = event['start'].get('dateTime', event['start'].get('date'))
-        summary = event.get('summary', 'No title')
-        output += f"• {format_datetime(start_time)} - {summary}\n"
-        output += f"  ID: {event['id']}\n\n"
+    def line(record):
+        text = f"• {format_datetime(record['start'])} - {record['summary']}\n"
+        if len(calendar_ids) > 1:
+            text += f"  🗓️ {record['calendar_id']}\n"
+        return text + f"  ID: {record['id']}\n\n"
     
-    return [TextContent(type="text", text=output)]
+    return render(
+        args,
+        [event_record(event) for event in events],
+        line,
+        header=f"🔍 Search results for '{query}':\n\n",
+        empty=f"No events found matching '{query}'",
+        query=query
+    )
 
 async def handle_send_email(service, args):
     """Send an email via Gmail"""
@@ -621,21 +1293,26 @@ async def handle_send_email(service, args):
     if 'bcc' in args:
         message['bcc'] = args['bcc']
     
-    # Encode message
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-    
     try:
-        sent_message = service.users().messages().send(
+        if args.get("queue"):
+            return queue_message("send", message, args, f"To {to}: {subject}")
+        
+        # Encode message
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+        
+        sent_message = await execute(service.users().messages().send(
             userId='me',
             body={'raw': raw_message}
-        ).execute()
+        ))
         
-        output = f"✅ Email sent successfully!\n\n"
-        output += f"📧 To: {to}\n"
-        output += f"📝 Subject: {subject}\n"
-        output += f"Message ID: {sent_message['id']}"
-        
-        return [TextContent(type="text", text=output)]
+        return render_one(
+            args,
+            f"✅ Email sent successfully!\n\n📧 To: {to}\n📝 Subject: {subject}\nMessage ID: {sent_message['id']}",
+            sent=True,
+            id=sent_message['id'],
+            to=to,
+            subject=subject
+        )
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to send email: {str(e)}")]
 
@@ -660,73 +1337,87 @@ async def handle_list_emails(service, args):
     query = " ".join(query_parts) if query_parts else None
     
     try:
-        results = service.users().messages().list(
+        results = await execute(service.users().messages().list(
             userId='me',
             q=query,
             maxResults=max_results
-        ).execute()
+        ))
         
         messages = results.get('messages', [])
         
-        if not messages:
-            return [TextContent(type="text", text=f"No emails found in {folder}")]
-        
-        output = f"📬 Emails in {folder}:\n\n"
-        
+        records = []
         for msg in messages:
-            msg_data = service.users().messages().get(
+            msg_data = await execute(service.users().messages().get(
                 userId='me',
                 id=msg['id'],
                 format='metadata',
                 metadataHeaders=['From', 'Subject', 'Date']
-            ).execute()
-            
-            headers = {h['name']: h['value'] for h in msg_data['payload']['headers']}
-            
-            output += f"• From: {headers.get('From', 'Unknown')}\n"
-            output += f"  Subject: {headers.get('Subject', 'No subject')}\n"
-            output += f"  Date: {headers.get('Date', 'Unknown')}\n"
-            output += f"  ID: {msg['id']}\n\n"
+            ))
+            records.append(email_record(msg['id'], get_headers(msg_data)))
         
-        return [TextContent(type="text", text=output)]
+        prefetcher.schedule([msg['id'] for msg in messages])
+        return render(
+            args,
+            records,
+            format_email_line,
+            header=f"📬 Emails in {folder}:\n\n",
+            empty=f"No emails found in {folder}",
+            folder=folder
+        )
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to list emails: {str(e)}")]
 
+def email_record(message_id: str, headers: dict) -> dict:
+    """Stable fields of a listed email for structured output"""
+    return {
+        'id': message_id,
+        'from': headers.get('From', 'Unknown'),
+        'subject': headers.get('Subject', 'No subject'),
+        'date': headers.get('Date', 'Unknown'),
+    }
+
+def format_email_line(record: dict) -> str:
+    """One email of a listing as text"""
+    return (
+        f"• From: {record['from']}\n"
+        f"  Subject: {record['subject']}\n"
+        f"  Date: {record['date']}\n"
+        f"  ID: {record['id']}\n\n"
+    )
+
 async def handle_search_emails(service, args):
     """Search emails by query"""
     query = args["query"]
     max_results = args.get("max_results", 10)
     
     try:
-        results = service.users().messages().list(
+        results = await execute(service.users().messages().list(
             userId='me',
             q=query,
             maxResults=max_results
-        ).execute()
+        ), hedge=True)
         
         messages = results.get('messages', [])
         
-        if not messages:
-            return [TextContent(type="text", text=f"No emails found matching '{query}'")]
-        
-        output = f"🔍 Search results for '{query}':\n\n"
-        
+        records = []
         for msg in messages:
-            msg_data = service.users().messages().get(
+            msg_data = await execute(service.users().messages().get(
                 userId='me',
                 id=msg['id'],
                 format='metadata',
                 metadataHeaders=['From', 'Subject', 'Date']
-            ).execute()
-            
-            headers = {h['name']: h['value'] for h in msg_data['payload']['headers']}
-            
-            output += f"• From: {headers.get('From', 'Unknown')}\n"
-            output += f"  Subject: {headers.get('Subject', 'No subject')}\n"
-            output += f"  Date: {headers.get('Date', 'Unknown')}\n"
-            output += f"  ID: {msg['id']}\n\n"
+            ), hedge=True)
+            records.append(email_record(msg['id'], get_headers(msg_data)))
         
-        return [TextContent(type="text", text=output)]
+        prefetcher.schedule([msg['id'] for msg in messages])
+        return render(
+            args,
+            records,
+            format_email_line,
+            header=f"🔍 Search results for '{query}':\n\n",
+            empty=f"No emails found matching '{query}'",
+            query=query
+        )
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to search emails: {str(e)}")]
 
@@ -735,38 +1426,176 @@ async def handle_read_email(service, args):
     email_id = args["email_id"]
     
     try:
-        msg = service.users().messages().get(
-            userId='me',
-            id=email_id,
-            format='full'
-        ).execute()
-        
-        headers = {h['name']: h['value'] for h in msg['payload']['headers']}
-        
-        # Extract body
-        body = ""
-        if 'parts' in msg['payload']:
-            for part in msg['payload']['parts']:
-                if part['mimeType'] == 'text/plain':
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                    break
-        elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-            body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8')
-        
-        output = f"📧 Email Details:\n\n"
-        output += f"From: {headers.get('From', 'Unknown')}\n"
-        output += f"To: {headers.get('To', 'Unknown')}\n"
-        output += f"Subject: {headers.get('Subject', 'No subject')}\n"
-        output += f"Date: {headers.get('Date', 'Unknown')}\n\n"
-        output += f"Body:\n{body[:1000]}"  # Limit body to 1000 chars
-        
-        if len(body) > 1000:
-            output += "\n\n[... truncated]"
-        
-        return [TextContent(type="text", text=output)]
+        msg = await prefetcher.get(email_id)
+        if msg is None:
+            msg = await get_message(service, email_id, MESSAGE_FIELDS, hedge=True)
+        
+        headers = get_headers(msg)
+        body = extract_text(msg['payload'])
+        
+        # Limit the body to 1000 chars, or to the token budget when one is given
+        limit = int(args["max_tokens"]) * CHARS_PER_TOKEN if args.get("max_tokens") else 1000
+        
+        record = email_record(email_id, headers)
+        record['to'] = headers.get('To', 'Unknown')
+        record['body'] = body[:limit]
+        record['truncated'] = len(body) > limit
+        
+        output = [
+            "📧 Email Details:\n\n",
+            f"From: {record['from']}\n",
+            f"To: {record['to']}\n",
+            f"Subject: {record['subject']}\n",
+            f"Date: {record['date']}\n\n",
+            f"Body:\n{record['body']}",
+        ]
+        if record['truncated']:
+            output.append("\n\n[... truncated]")
+        
+        return render_one(args, "".join(output), **record)
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to read email: {str(e)}")]
 
+async def handle_list_threads(service, args):
+    """List conversations with one batched metadata fetch"""
+    query = args.get("query", "in:inbox")
+    max_results = args.get("max_results", 10)
+    
+    try:
+        results = await execute(service.users().threads().list(
+            userId='me',
+            q=query,
+            maxResults=max_results
+        ))
+        
+        threads = results.get('threads', [])
+        
+        # Fetch every thread's headers in batched HTTP round trips
+        details = {}
+        
+        def collect(request_id, response, exception):
+            if exception is None:
+                details[request_id] = response
+        
+        for i in range(0, len(threads), GMAIL_BATCH_MAX):
+            batch = service.new_batch_http_request(callback=collect)
+            for thread in threads[i:i + GMAIL_BATCH_MAX]:
+                batch.add(
+                    service.users().threads().get(
+                        userId='me',
+                        id=thread['id'],
+                        format='metadata',
+                        metadataHeaders=['From', 'Subject', 'Date'],
+                        fields='id,messages(id,payload/headers)'
+                    ),
+                    request_id=thread['id']
+                )
+            await execute(batch)
+        
+        records = []
+        for thread in threads:
+            messages = details.get(thread['id'], {}).get('messages', [])
+            first = get_headers(messages[0]) if messages else {}
+            last = get_headers(messages[-1]) if messages else {}
+            records.append({
+                'id': thread['id'],
+                'subject': first.get('Subject', 'No subject'),
+                'messages': len(messages),
+                'senders': list(dict.fromkeys(get_headers(m).get('From', 'Unknown') for m in messages)),
+                'last_date': last.get('Date', 'Unknown'),
+                'snippet': thread.get('snippet', ''),
+            })
+        
+        def line(record):
+            senders = record['senders']
+            return (
+                f"• {record['subject']} ({record['messages']} messages)\n"
+                f"  From: {', '.join(senders[:3])}{' …' if len(senders) > 3 else ''}\n"
+                f"  Last: {record['last_date']}\n"
+                f"  {record['snippet']}\n"
+                f"  Thread ID: {record['id']}\n\n"
+            )
+        
+        return render(
+            args,
+            records,
+            line,
+            header=f"🧵 Threads matching '{query}':\n\n",
+            empty=f"No threads found matching '{query}'",
+            query=query
+        )
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to list threads: {str(e)}")]
+
+async def handle_read_thread(service, args):
+    """Read a whole conversation with a single threads.get"""
+    thread_id = args["thread_id"]
+    offset = int(args.get("offset", 0))
+    max_messages = int(args.get("max_messages", 10))
+    
+    try:
+        thread = await execute(service.users().threads().get(
+            userId='me',
+            id=thread_id,
+            format='full',
+            fields='id,messages(id,payload)'
+        ))
+        
+        messages = thread.get('messages', [])
+        if not messages:
+            return [TextContent(type="text", text=f"Thread {thread_id} has no messages")]
+        
+        # Quotes only repeat earlier messages, so track what has been seen
+        seen_lines = set()
+        bodies = []
+        for msg in messages:
+            body = extract_text(msg['payload'])
+            bodies.append(strip_quoted(body, seen_lines))
+            seen_lines.update(line.strip() for line in body.splitlines() if line.strip())
+        
+        subject = get_headers(messages[0]).get('Subject', 'No subject')
+        page = range(offset, min(offset + max_messages, len(messages)))
+        
+        records = []
+        for i in page:
+            headers = get_headers(messages[i])
+            records.append({
+                'index': i + 1,
+                'id': messages[i]['id'],
+                'from': headers.get('From', 'Unknown'),
+                'date': headers.get('Date', 'Unknown'),
+                'body': bodies[i][:1000],
+                'truncated': len(bodies[i]) > 1000,
+            })
+        
+        def line(record):
+            body = record['body']
+            if record['truncated']:
+                body += "\n[... truncated]"
+            return (
+                f"── {record['index']}. From: {record['from']}\n"
+                f"   Date: {record['date']}\n"
+                f"   ID: {record['id']}\n\n"
+                f"{body}\n\n"
+            )
+        
+        footer = ""
+        if page.stop < len(messages):
+            footer = f"[{len(messages) - page.stop} more messages, use offset={page.stop}]"
+        
+        return render(
+            args,
+            records,
+            line,
+            header=f"🧵 {subject} ({len(messages)} messages)\n\n",
+            footer=footer,
+            thread_id=thread_id,
+            subject=subject,
+            total=len(messages)
+        )
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to read thread: {str(e)}")]
+
 async def handle_mark_email(service, args):
     """Mark email as read/unread"""
     email_id = args["email_id"]
@@ -774,19 +1603,19 @@ async def handle_mark_email(service, args):
     
     try:
         if mark_as == "read":
-            service.users().messages().modify(
+            await execute(service.users().messages().modify(
                 userId='me',
                 id=email_id,
                 body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            return [TextContent(type="text", text=f"✅ Email marked as read")]
+            ))
+            return render_one(args, "✅ Email marked as read", id=email_id, unread=False)
         else:
-            service.users().messages().modify(
+            await execute(service.users().messages().modify(
                 userId='me',
                 id=email_id,
                 body={'addLabelIds': ['UNREAD']}
-            ).execute()
-            return [TextContent(type="text", text=f"✅ Email marked as unread")]
+            ))
+            return render_one(args, "✅ Email marked as unread", id=email_id, unread=True)
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to mark email: {str(e)}")]
 
@@ -797,11 +1626,13 @@ async def handle_delete_email(service, args):
     
     try:
         if permanent:
-            service.users().messages().delete(userId='me', id=email_id).execute()
-            return [TextContent(type="text", text=f"✅ Email permanently deleted")]
+            await execute(service.users().messages().delete(userId='me', id=email_id))
+            prefetcher.discard(email_id)
+            forget_message(email_id)
+            return render_one(args, "✅ Email permanently deleted", id=email_id, deleted=True)
         else:
-            service.users().messages().trash(userId='me', id=email_id).execute()
-            return [TextContent(type="text", text=f"✅ Email moved to trash")]
+            await execute(service.users().messages().trash(userId='me', id=email_id))
+            return render_one(args, "✅ Email moved to trash", id=email_id, trashed=True)
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to delete email: {str(e)}")]
 
@@ -812,12 +1643,12 @@ async def handle_reply_to_email(service, args):
     
     try:
         # Get original message
-        original = service.users().messages().get(
+        original = await execute(service.users().messages().get(
             userId='me',
             id=email_id,
             format='metadata',
             metadataHeaders=['From', 'Subject', 'Message-ID']
-        ).execute()
+        ))
         
         headers = {h['name']: h['value'] for h in original['payload']['headers']}
         
@@ -828,14 +1659,26 @@ async def handle_reply_to_email(service, args):
         message['In-Reply-To'] = headers.get('Message-ID', '')
         message['References'] = headers.get('Message-ID', '')
         
+        if args.get("queue"):
+            return queue_message(
+                "send", message, args, f"Reply to {headers.get('From')}: {message['subject']}",
+                thread_id=original['threadId']
+            )
+        
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
         
-        sent_message = service.users().messages().send(
+        sent_message = await execute(service.users().messages().send(
             userId='me',
             body={'raw': raw_message, 'threadId': original['threadId']}
-        ).execute()
+        ))
         
-        return [TextContent(type="text", text=f"✅ Reply sent successfully!\nMessage ID: {sent_message['id']}")]
+        return render_one(
+            args,
+            f"✅ Reply sent successfully!\nMessage ID: {sent_message['id']}",
+            sent=True,
+            id=sent_message['id'],
+            thread_id=original['threadId']
+        )
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to send reply: {str(e)}")]
 
@@ -850,31 +1693,163 @@ async def handle_create_draft(service, args):
         message['to'] = to
         message['subject'] = subject
         
+        if args.get("queue"):
+            return queue_message("draft", message, args, f"Draft to {to}: {subject}")
+        
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
         
-        draft = service.users().drafts().create(
+        draft = await execute(service.users().drafts().create(
             userId='me',
             body={'message': {'raw': raw_message}}
-        ).execute()
+        ))
         
-        return [TextContent(type="text", text=f"✅ Draft created successfully!\nDraft ID: {draft['id']}")]
+        return render_one(args, f"✅ Draft created successfully!\nDraft ID: {draft['id']}", draft_id=draft['id'])
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to create draft: {str(e)}")]
 
+def queue_message(kind: str, message, args, summary: str, thread_id: str = None):
+    """Put a message in the outbox instead of sending it during the call"""
+    # A Message-ID of our own lets a restart tell whether Gmail already has it
+    message['Message-ID'] = make_msgid()
+    body = {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')}
+    if thread_id:
+        body['threadId'] = thread_id
+    if kind == "draft":
+        body = {'message': body}
+    
+    row, created = outbox.enqueue(kind, body, message['Message-ID'], summary, args.get("idempotency_key"))
+    what = "Draft" if kind == "draft" else "Email"
+    if created:
+        text = f"📤 {what} queued\nQueue ID: {row['id']}\nUse outbox_status to check on it."
+    else:
+        text = f"📤 Already queued with this idempotency key\nQueue ID: {row['id']}\nStatus: {row['status']}"
+    return render_one(args, text, queue_id=row['id'], status=row['status'], created=created)
+
+async def handle_outbox_status(service, args):
+    """Show queued emails and drafts"""
+    try:
+        counts = {}
+        if args.get("queue_id") is not None:
+            row = outbox.get(int(args["queue_id"]))
+            if row is None:
+                return [TextContent(type="text", text=f"❌ No queued message with ID {args['queue_id']}")]
+            rows = [row]
+            header = "📤 Outbox entry:\n\n"
+        else:
+            rows = outbox.recent()
+            counts = outbox.counts()
+            header = f"📤 Outbox ({', '.join(f'{count} {status}' for status, count in sorted(counts.items()))}):\n\n"
+        
+        records = [
+            {
+                'queue_id': row['id'],
+                'kind': row['kind'],
+                'summary': row['summary'],
+                'status': row['status'],
+                'attempts': row['attempts'],
+                'result_id': row['result_id'],
+                'error': row['error'],
+            }
+            for row in rows
+        ]
+        
+        def line(record):
+            text = f"• [{record['queue_id']}] {record['summary']}\n"
+            text += f"  Status: {record['status']} (attempts: {record['attempts']})\n"
+            if record['result_id']:
+                text += f"  Gmail ID: {record['result_id']}\n"
+            if record['error']:
+                text += f"  Last error: {record['error']}\n"
+            return text + "\n"
+        
+        return render(args, records, line, header=header, empty="Outbox is empty", counts=counts)
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to read outbox: {str(e)}")]
+
+async def handle_analyze_mailbox(service, args):
+    """Stream every matching message's headers into summary counters"""
+    query = args.get("query")
+    top = int(args.get("top", 10))
+    
+    try:
+        stats, info = await asyncio.to_thread(
+            analyze_mailbox,
+            query,
+            int(args.get("max_messages", 10000)),
+            progress=progress_reporter()
+        )
+    except Exception as e:
+        return [TextContent(type="text", text=f"❌ Failed to analyze mailbox: {str(e)}")]
+    
+    if not stats.messages:
+        return [TextContent(type="text", text=f"No emails found matching '{query or 'all mail'}'")]
+    
+    # Long histories are shown per year to keep the summary short
+    volume = stats.months
+    period = "month"
+    if len(volume) > 24:
+        volume = Counter()
+        for month, count in stats.months.items():
+            volume[month[:4]] += count
+        period = "year"
+    
+    summary = {
+        'query': query,
+        'messages': stats.messages,
+        'estimate': info['estimate'],
+        'truncated': info['truncated'],
+        'failed': info['failed'],
+        'first': stats.first.isoformat() if stats.first else None,
+        'last': stats.last.isoformat() if stats.last else None,
+        'bulk': stats.bulk,
+        'senders': stats.senders.most_common(top),
+        'domains': stats.domains.most_common(top),
+        'labels': [(info['label_names'].get(label_id, label_id), count) for label_id, count in stats.labels.most_common(top)],
+        'volume_period': period,
+        'volume': sorted(volume.items()),
+    }
+    
+    output = [f"📊 Mailbox analysis for '{query or 'all mail'}':\n\n", f"Messages analyzed: {stats.messages}"]
+    if info['truncated']:
+        output.append(f" (stopped at max_messages; about {info['estimate']} match)")
+    output.append("\n")
+    if info['failed']:
+        output.append(f"Could not fetch: {info['failed']}\n")
+    if stats.first:
+        output.append(f"Period: {stats.first.date()} to {stats.last.date()}\n")
+    output.append(f"Newsletters and mailing lists: {stats.bulk} ({stats.bulk / stats.messages:.0%})\n")
+    
+    for title, counter, key in (("Top senders", stats.senders, 'senders'), ("Top domains", stats.domains, 'domains')):
+        output.append(f"\n{title}:\n")
+        output.extend(f"  {count:>6}  {name}\n" for name, count in summary[key])
+        if counter.max_error(top):
+            output.append(f"  (counts may be high by up to {counter.max_error(top)})\n")
+    
+    output.append("\nLabels:\n")
+    output.extend(f"  {count:>6}  {name}\n" for name, count in summary['labels'])
+    
+    output.append(f"\nVolume by {period}:\n")
+    peak = max(volume.values())
+    output.extend(
+        f"  {key:<7}  {count:>6}  {'█' * max(1, round(20 * count / peak))}\n"
+        for key, count in summary['volume']
+    )
+    
+    return render_one(args, "".join(output), **summary)
+
 async def handle_list_labels(service, args):
     """List all Gmail labels"""
     try:
-        results = service.users().labels().list(userId='me').execute()
+        results = await execute(service.users().labels().list(userId='me'))
         labels = results.get('labels', [])
         
-        if not labels:
-            return [TextContent(type="text", text="No labels found")]
-        
-        output = "🏷️  Gmail Labels:\n\n"
-        for label in labels:
-            output += f"• {label['name']} (ID: {label['id']})\n"
-        
-        return [TextContent(type="text", text=output)]
+        return render(
+            args,
+            [{'id': label['id'], 'name': label['name']} for label in labels],
+            lambda label: f"• {label['name']} (ID: {label['id']})\n",
+            header="🏷️  Gmail Labels:\n\n",
+            empty="No labels found"
+        )
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to list labels: {str(e)}")]
 
@@ -885,7 +1860,7 @@ async def handle_add_label(service, args):
     
     try:
         # Get all labels to find ID
-        results = service.users().labels().list(userId='me').execute()
+        results = await execute(service.users().labels().list(userId='me'))
         labels = results.get('labels', [])
         
         label_id = None
@@ -897,24 +1872,44 @@ async def handle_add_label(service, args):
         if not label_id:
             return [TextContent(type="text", text=f"❌ Label '{label_name}' not found")]
         
-        service.users().messages().modify(
+        await execute(service.users().messages().modify(
             userId='me',
             id=email_id,
             body={'addLabelIds': [label_id]}
-        ).execute()
+        ))
         
-        return [TextContent(type="text", text=f"✅ Label '{label_name}' added to email")]
+        return render_one(args, f"✅ Label '{label_name}' added to email", id=email_id, label=label_name, label_id=label_id)
     except Exception as e:
         return [TextContent(type="text", text=f"❌ Failed to add label: {str(e)}")]
 
 async def main():
     """Run the MCP server"""
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            app.create_initialization_options()
-        )
+    global push_manager
+    if PUSH_ADDRESS:
+        try:
+            push_manager = PushManager(PUSH_ADDRESS, GMAIL_TOPIC)
+            await push_manager.start()
+        except Exception as e:
+            print(f"Push notifications disabled: {e}", file=sys.stderr)
+            push_manager = None
+    
+    # Resume sending anything a previous run left in the outbox
+    if outbox.path.exists():
+        outbox.start()
+    
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await app.run(
+                read_stream,
+                write_stream,
+                app.create_initialization_options()
+            )
+    finally:
+        resources.close()
+        await outbox.stop()
+        await prefetcher.stop()
+        if push_manager is not None:
+            await push_manager.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,95 @@
+"""Shared datetime parsing, formatting and timezone helpers"""
+import time
+from datetime import date, datetime, timezone, tzinfo
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from .deadlines import CallCancelled, DeadlineExceeded, execute
+
+# Wait before asking again after the timezone could not be read
+TIMEZONE_RETRY_SECONDS = 30
+
+_user_timezone = None
+_timezone_retry_at = None
+
+@lru_cache(maxsize=None)
+def get_zone(name: str) -> tzinfo:
+    """Return a cached ZoneInfo for an IANA timezone name"""
+    if name in ('UTC', 'Z'):
+        return timezone.utc
+    return ZoneInfo(name)
+
+def to_utc(dt: datetime) -> datetime:
+    """Treat naive datetimes as UTC and convert aware ones to UTC"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+def parse_iso(value: str) -> datetime:
+    """Parse an ISO 8601 string, including a trailing 'Z'"""
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+@lru_cache(maxsize=1024)
+def _parse_natural(value: str, today: date) -> datetime:
+    # dateutil's heuristic parser is slow, so only pay for it once per string
+    # and day; missing fields such as the date in "3pm" are filled from today
+    from dateutil import parser
+    return parser.parse(value, default=datetime.combine(today, datetime.min.time()))
+
+def parse_datetime(value: str, zone: str = None) -> datetime:
+    """Parse ISO or natural-language input into a datetime
+
+    ISO strings take the fromisoformat fast path. Naive results are placed
+    in zone when one is given.
+    """
+    value = value.strip()
+    try:
+        dt = parse_iso(value)
+    except ValueError:
+        dt = _parse_natural(value, date.today())
+    if zone and dt.tzinfo is None:
+        dt = dt.replace(tzinfo=get_zone(zone))
+    return dt
+
+@lru_cache(maxsize=4096)
+def _format_iso(dt_str: str) -> str:
+    try:
+        return parse_iso(dt_str).strftime('%a, %b %d at %I:%M %p')
+    except ValueError:
+        return dt_str
+
+def format_datetime(value, zone: str = None) -> str:
+    """Format an ISO string or datetime as a readable string
+
+    Strings keep their own offset; datetimes are shown in zone when given.
+    """
+    if isinstance(value, datetime):
+        if zone:
+            value = to_utc(value).astimezone(get_zone(zone))
+        return value.strftime('%a, %b %d at %I:%M %p')
+    return _format_iso(value)
+
+async def get_user_timezone(service) -> str:
+    """The user's calendar timezone, fetched once per process
+
+    Only a successful read is cached. If the setting cannot be read, UTC
+    is used for this call and the fetch is retried after
+    TIMEZONE_RETRY_SECONDS. The call's own deadline or cancellation
+    propagates instead.
+    """
+    global _user_timezone, _timezone_retry_at
+    if _user_timezone is not None:
+        return _user_timezone
+    if _timezone_retry_at is not None and time.monotonic() < _timezone_retry_at:
+        return 'UTC'
+    try:
+        setting = await execute(service.settings().get(setting='timezone'))
+    except (DeadlineExceeded, CallCancelled):
+        raise
+    except Exception:
+        _timezone_retry_at = time.monotonic() + TIMEZONE_RETRY_SECONDS
+        return 'UTC'
+    _user_timezone = setting.get('value') or 'UTC'
+    _timezone_retry_at = None
+    return _user_timezone
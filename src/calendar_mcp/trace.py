@@ -0,0 +1,28 @@
+"""Recording of tool calls for replay by the load generator
+
+With CALENDAR_MCP_TRACE set to a path, the server appends every tool call
+it handles to that file as one JSON line of {"tool", "arguments"}.
+"""
+import json
+import os
+import threading
+
+TRACE_PATH = os.environ.get('CALENDAR_MCP_TRACE')
+
+_trace_lock = threading.Lock()
+
+def record_call(name: str, arguments: dict):
+    """Append one tool call to the trace file"""
+    line = json.dumps({'tool': name, 'arguments': arguments or {}}, default=str)
+    with _trace_lock, open(TRACE_PATH, 'a', encoding='utf-8') as trace:
+        trace.write(line + '\n')
+
+def load_trace(path) -> list[dict]:
+    """Tool calls from a JSON lines trace"""
+    calls = []
+    with open(path, encoding='utf-8') as trace:
+        for line in trace:
+            if line.strip():
+                call = json.loads(line)
+                calls.append({'tool': call['tool'], 'arguments': call.get('arguments') or {}})
+    return calls